@@ -1,14 +1,161 @@
 import os
 import json
 import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Point at another chat-completions server (e.g. a local stub) instead of api.openai.com
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL') or None
+OPENAI_TIMEOUT = float(os.environ.get('OPENAI_TIMEOUT', 60))
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get('OPENAI_CONNECT_TIMEOUT', 5))
+OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', 2))
+
+def key_hash(api_key):
+    # Pool entries are looked up by digest so raw keys never become dict keys
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+class PooledClient:
+    __slots__ = ('client', 'leases', 'last_used', 'retired')
+
+    def __init__(self, client):
+        self.client = client
+        self.leases = 0
+        self.last_used = time.monotonic()
+        self.retired = False
+
+class ClientPool:
+    """
+    OpenAI clients reused across requests, one per API key, each with its
+    own keep-alive HTTP connection pool so repeat users skip the TCP/TLS
+    setup. Holds at most max_clients; clients unused for idle_timeout
+    seconds, or least recently used beyond the limit, are closed once no
+    request is still using them.
+    """
+    def __init__(self, max_clients=32, idle_timeout=300, base_url=OPENAI_BASE_URL, timeout=OPENAI_TIMEOUT,
+                 connect_timeout=OPENAI_CONNECT_TIMEOUT, max_retries=OPENAI_MAX_RETRIES, keepalive_connections=5):
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        self.base_url = base_url
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.keepalive_connections = keepalive_connections
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.created = 0
+        self.evictions = 0
+
+    def create(self, api_key):
+        import httpx
+        from openai import OpenAI
+        http_client = httpx.Client(
+            timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(max_keepalive_connections=self.keepalive_connections,
+                                keepalive_expiry=self.idle_timeout))
+        return OpenAI(api_key=api_key, base_url=self.base_url, http_client=http_client,
+                      max_retries=self.max_retries, timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout))
+
+    @contextmanager
+    def client(self, api_key):
+        """
+        Leases the client for api_key (creating it if needed) for the
+        duration of the with block.
+        """
+        key = key_hash(api_key)
+        with self.lock:
+            closing = self.evict_idle()
+            entry = self.lease(key)
+        self.close(closing)
+        if entry is None:
+            # Built outside the lock: the first call pays the openai/httpx
+            # imports, which other users' calls shouldn't wait behind
+            fresh = PooledClient(self.create(api_key))
+            with self.lock:
+                entry = self.lease(key)
+                if entry is None:
+                    entry = fresh
+                    entry.leases += 1
+                    self.entries[key] = entry
+                    self.created += 1
+                    closing = []
+                    while len(self.entries) > self.max_clients:
+                        _, old = self.entries.popitem(last=False)
+                        closing.append(self.retire(old))
+                else:
+                    # Another request created one first; keep theirs
+                    closing = [fresh]
+            self.close(closing)
+        try:
+            yield entry.client
+        finally:
+            with self.lock:
+                entry.leases -= 1
+                entry.last_used = time.monotonic()
+                done = entry.retired and entry.leases == 0
+            if done:
+                self.close([entry])
+
+    def lease(self, key):
+        # Caller holds self.lock; the pooled entry for key, leased, or None
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            entry.leases += 1
+        return entry
+
+    def evict_idle(self):
+        # Caller holds self.lock; returns the entries to close
+        now = time.monotonic()
+        idle = [key for key, entry in self.entries.items()
+                if entry.leases == 0 and now - entry.last_used > self.idle_timeout]
+        return [self.retire(self.entries.pop(key)) for key in idle]
+
+    def retire(self, entry):
+        # Caller holds self.lock; in-use clients are closed by their last lease
+        entry.retired = True
+        self.evictions += 1
+        return entry if entry.leases == 0 else None
+
+    @staticmethod
+    def close(entries):
+        for entry in entries:
+            if entry is not None:
+                try:
+                    entry.client.close()
+                except Exception as e:
+                    print(f"AI client close error: {e}")
+
+    def clear(self):
+        with self.lock:
+            closing = [self.retire(entry) for entry in self.entries.values()]
+            self.entries.clear()
+        self.close(closing)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'clients': len(self.entries),
+                'max_clients': self.max_clients,
+                'hits': self.hits,
+                'created': self.created,
+                'evictions': self.evictions
+            }
+
+client_pool = ClientPool(max_clients=int(os.environ.get('AI_CLIENT_POOL_SIZE', 32)),
+                         idle_timeout=float(os.environ.get('AI_CLIENT_IDLE_SECONDS', 300)),
+                         keepalive_connections=int(os.environ.get('AI_KEEPALIVE_CONNECTIONS', 5)))
 
 class AIService:
-    def __init__(self):
-        pass
+    def __init__(self, pool=None):
+        self.pool = pool or client_pool
 
     def get_client(self, api_key):
-        from openai import OpenAI
-        return OpenAI(api_key=api_key)
+        return self.pool.client(api_key)
 
     def extract_json_from_text(self, text):
         try:
@@ -27,8 +174,6 @@ class AIService:
         """
         Single-shot generation from a prompt.
         """
-        client = self.get_client(api_key)
-        
         system_prompt = """
         You are a 3D printing expert. Interpret the user's request for a keychain design and return a JSON object with these parameters:
         - text_content: The text to put on the keychain (if implied by the user, e.g. "for mom" -> "Mom"). If not specified, return null.
@@ -61,14 +206,15 @@ class AIService:
         }
         """
         
-        completion = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={ "type": "json_object" }
-        )
+        with self.get_client(api_key) as client:
+            completion = client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                response_format={ "type": "json_object" }
+            )
         
         return json.loads(completion.choices[0].message.content)
 
@@ -76,8 +222,6 @@ class AIService:
         """
         Interactive chat with the user.
         """
-        client = self.get_client(api_key)
-        
         system_prompt = """
         You are an expert 3D printing design assistant for a keychain creator app.
         Your goal is to help the user design a custom keychain by asking clarifying questions.
@@ -118,10 +262,11 @@ class AIService:
         
         full_messages = [{"role": "system", "content": system_prompt}] + messages
         
-        completion = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=full_messages
-        )
+        with self.get_client(api_key) as client:
+            completion = client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=full_messages
+            )
         
         reply = completion.choices[0].message.content
         config = self.extract_json_from_text(reply)
@@ -1,11 +1,27 @@
 import os
+import io
+import glob
 import time
 import json
 import uuid
-from flask import Flask, request, jsonify, render_template, send_from_directory
+import hmac
+import threading
+import hashlib
+import gzip
+import shutil
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, Response, request, jsonify, render_template, send_file
 from flask_cors import CORS
+try:
+    import brotli
+except ImportError:
+    brotli = None
 from werkzeug.utils import secure_filename
-from mesh_generator import process_image_to_mesh
+from mesh_generator import process_image_to_mesh, process_text_to_mesh, StageReporter, MASK_SUFFIX, QUALITY_PRESETS, PX_PER_MM
+from mesh_export import stl_records, iter_stl, stl_size, STL_CHUNK_RECORDS, write_3mf_plate, plate_layout
+from upload_pipeline import normalize_upload, find_upload
+from artifact_store import ArtifactStore
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 CORS(app)
@@ -18,6 +34,61 @@ os.makedirs(PROCESSING_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB limit
 
+def artifact_group(name):
+    # 'abc.mask.png', 'abc.json' -> 'abc'; 'abc_base.stl', 'abc_profile.folded' -> 'abc'
+    stem = name.split('.', 1)[0]
+    for suffix in ('_base', '_text', '_profile'):
+        if stem.endswith(suffix):
+            return stem[:-len(suffix)]
+    return stem
+
+def classify_upload(name):
+    if name.endswith(MASK_SUFFIX):
+        kind = 'upload'
+    elif name.endswith('.json'):
+        kind = 'upload_meta'
+    elif name.startswith('preview_'):
+        kind = 'preview'
+    elif name.startswith('text_'):
+        kind = 'text_render'
+    else:
+        kind = 'upload'
+    return kind, artifact_group(name)
+
+def classify_output(name):
+    if name.endswith('.folded'):
+        kind = 'profile'
+    elif name.endswith(('.gz', '.br')):
+        kind = 'sidecar'
+    elif name.endswith('.kcm'):
+        kind = 'viewer_mesh'
+    else:
+        kind = 'mesh'
+    return kind, artifact_group(name)
+
+# Both folders are indexed, capped and swept; small outputs are also served from memory
+ARTIFACT_TTL = float(os.environ.get('ARTIFACT_TTL_HOURS', 24)) * 3600
+upload_store = ArtifactStore(UPLOAD_FOLDER, max_bytes=int(os.environ.get('UPLOAD_QUOTA_MB', 1024)) * 1024 * 1024,
+                             ttl=ARTIFACT_TTL, classify=classify_upload)
+output_store = ArtifactStore(PROCESSING_FOLDER, max_bytes=int(os.environ.get('OUTPUT_QUOTA_MB', 2048)) * 1024 * 1024,
+                             ttl=ARTIFACT_TTL, memory_bytes=int(os.environ.get('ARTIFACT_MEMORY_MB', 64)) * 1024 * 1024,
+                             classify=classify_output)
+stores_scanned = threading.Event()
+stores_lock = threading.Lock()
+
+@app.before_request
+def scan_artifact_stores():
+    # Indexes files left by a previous run (and starts the sweepers) in the
+    # process that serves requests only: not on import, so the debug
+    # reloader's parent or a script importing app keeps no second index
+    if stores_scanned.is_set():
+        return
+    with stores_lock:
+        if not stores_scanned.is_set():
+            upload_store.scan()
+            output_store.scan()
+            stores_scanned.set()
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -37,70 +108,217 @@ def upload_file():
     if file:
         filename = secure_filename(file.filename)
         file_id = str(uuid.uuid4())
-        ext = os.path.splitext(filename)[1]
-        saved_filename = f"{file_id}{ext}"
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], saved_filename)
-        file.save(file_path)
+        # Decode once and keep only the binary mask generate traces
+        try:
+            meta = normalize_upload(file.read(), app.config['UPLOAD_FOLDER'], file_id, filename)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        upload_store.register(f"{file_id}{MASK_SUFFIX}", 'upload', group=file_id)
+        upload_store.register(f"{file_id}.json", 'upload_meta', group=file_id)
         
         return jsonify({
             'message': 'File uploaded successfully',
             'file_id': file_id,
-            'filename': saved_filename
+            'filename': f"{file_id}{MASK_SUFFIX}",
+            'width_mm': meta['width_mm'],
+            'height_mm': meta['height_mm']
         })
 
-from font_manager import get_font_path
-from PIL import Image, ImageDraw, ImageFont
+from font_manager import get_font_path, font_registry
+from glyph_outline import load_font as load_glyph_font
+from functools import lru_cache
+from text_render import TEXT_FONT_SIZE, TEXT_PADDING, load_font, render_text_image, create_text_image
+
+def preload_font(font_name, font_path):
+    # Warm both text paths so the first request doesn't pay font parsing
+    load_font(font_path, TEXT_FONT_SIZE)
+    load_glyph_font(font_path)
+
+# Check every FONT_MAP font at startup; missing ones download in the background
+font_registry.warm(download_missing=os.environ.get('FONT_DOWNLOADS', '1') == '1',
+                   on_ready=preload_font)
+
+@app.route('/api/fonts', methods=['GET'])
+def font_status():
+    return jsonify(font_registry.snapshot())
 
-def create_text_image(text, output_path, font_name='sans'):
+PREVIEW_FONT_SIZE = 64
+PREVIEW_MAX_TEXT = 200
+PREVIEW_TYPES = {'webp': 'image/webp', 'png': 'image/png'}
+
+def preview_etag(text, font_path, size, fmt):
+    # Derived from the inputs, so a revalidation is answered without rendering
+    key = json.dumps([text, font_path, size, fmt]).encode('utf-8')
+    return hashlib.sha256(key).hexdigest()[:32]
+
+@lru_cache(maxsize=int(os.environ.get('PREVIEW_CACHE_SIZE', 256)))
+def encode_preview(text, font_path, size, fmt):
     """
-    Creates a high-res image of the text for contour tracing.
+    Low-resolution preview of the text, encoded in memory. Cached by
+    (text, font, size, format).
     """
-    try:
-        # High resolution for better tracing
-        img_size = (2000, 2000) # Increased canvas size
-        img = Image.new('RGB', img_size, color='white')
-        draw = ImageDraw.Draw(img)
-        
-        font_path = get_font_path(font_name)
-        font_size = 200 # Larger font for better details
-        
-        try:
-            font = ImageFont.truetype(font_path, font_size)
-        except Exception as e:
-            print(f"Font load error: {e}, using default")
-            font = ImageFont.load_default()
-            
-        # Calculate text size
-        bbox = draw.textbbox((0, 0), text, font=font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-        # Center text
-        x = (img_size[0] - text_width) / 2
-        y = (img_size[1] - text_height) / 2
-        
-        draw.text((x, y), text, font=font, fill='black')
-        
-        # Crop to text with padding
-        padding = 50
-        crop_box = (
-            max(0, x - padding),
-            max(0, y - padding),
-            min(img_size[0], x + text_width + padding),
-            min(img_size[1], y + text_height + padding)
-        )
-        img = img.crop(crop_box)
-        
-        img.save(output_path)
-        return True
-    except Exception as e:
-        print(f"Error creating text image: {e}")
-        raise
+    img = render_text_image(text, font_path, font_size=size, padding=max(2, size * TEXT_PADDING // TEXT_FONT_SIZE))
+    buf = io.BytesIO()
+    if fmt == 'webp':
+        img.save(buf, 'WEBP', lossless=True, method=0)
+    else:
+        img.save(buf, 'PNG')
+    return buf.getvalue()
+
+def inline_preview(text, font_name, size, fmt=None):
+    """
+    Response with the preview image itself, or 304 if the client's copy
+    (If-None-Match) is current.
+    """
+    size = max(8, min(size, TEXT_FONT_SIZE))
+    if fmt not in PREVIEW_TYPES:
+        # Only when asked for by name; */* clients get PNG
+        fmt = 'webp' if any(v == 'image/webp' for v, _ in request.accept_mimetypes) else 'png'
+    font_path = get_font_path(font_name)
+    etag = preview_etag(text, font_path, size, fmt)
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'public, max-age=3600', 'Vary': 'Accept'}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    data = encode_preview(text, font_path, size, fmt)
+    return Response(data, mimetype=PREVIEW_TYPES[fmt], headers=headers)
 
-from ai_service import AIService
+from ai_service import AIService, client_pool, key_hash
+from result_cache import ResultCache
+
+from job_queue import JobQueue, QueueFull
+from mesh_executor import MeshExecutor
+from zip_stream import stream_zip
+import metrics
+from profiler import StackSampler, profile_call
+
+result_cache = ResultCache(max_entries=int(os.environ.get('RESULT_CACHE_SIZE', 256)))
+# MESH_WORKERS=0 runs generation inline in the request thread
+mesh_workers = os.environ.get('MESH_WORKERS')
+mesh_executor = MeshExecutor(workers=int(mesh_workers) if mesh_workers else None,
+                             max_jobs_per_worker=int(os.environ.get('MESH_JOBS_PER_WORKER', 50)))
+job_queue = JobQueue(workers=int(os.environ.get('GENERATE_WORKERS', 2)),
+                     max_pending=int(os.environ.get('GENERATE_MAX_PENDING', 64)))
+# 'stl' writes the combined and part STLs, '3mf' one multi-material package
+OUTPUT_FORMATS = ['stl', '3mf']
+# Profiling a request needs this token in X-Admin-Token; unset disables it
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+
+def profiling_requested():
+    """
+    True if the request asks to be profiled (?profile=1 or X-Profile: 1)
+    with a valid admin token. A bad or missing token raises PermissionError.
+    """
+    if request.args.get('profile') != '1' and request.headers.get('X-Profile') != '1':
+        return False
+    token = request.headers.get('X-Admin-Token', '')
+    if not PROFILE_TOKEN or not hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode()):
+        raise PermissionError("Profiling requires a valid admin token")
+    return True
 
 @app.route('/api/generate', methods=['POST'])
 def generate_model():
     data = request.json
+    try:
+        profile = profiling_requested()
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    
+    # Job mode: queue the work and let the client poll /api/jobs/<id>
+    if data.get('async') or request.args.get('mode') == 'job':
+        job_data = dict(data)
+        job_params = {k: v for k, v in job_data.items() if k not in ('api_key', 'async')}
+        if job_data.get('use_ai'):
+            # Whether (and with whose key) the AI runs changes the result;
+            # the digest keeps the raw key out of the job key
+            api_key = job_data.get('api_key')
+            job_params['api_key_hash'] = key_hash(api_key) if api_key else None
+        # A profiled job must not be merged with an ordinary one
+        job_key = result_cache.make_key(b'generate-profile' if profile else b'generate', job_params)
+        try:
+            job, deduplicated = job_queue.submit(job_key, lambda job: run_generate_job(job_data, job, profile))
+        except QueueFull as e:
+            return jsonify({'error': str(e)}), 503
+        return jsonify({
+            'job_id': job.id,
+            'status': job.state,
+            'status_url': f"/api/jobs/{job.id}",
+            'events_url': f"/api/jobs/{job.id}/events",
+            'deduplicated': deduplicated
+        }), 202
+    
+    # download=stl: answer with the combined STL itself, never written to disk
+    stream = request.args.get('download') == 'stl' or data.get('download') == 'stl'
+    payload, status = generate_from_request(data, profile=profile, stream=stream)
+    if stream and status == 200:
+        return stl_response(payload['parts'], f"{payload['file_id']}.stl")
+    return jsonify(payload), status
+
+def stl_response(parts, filename):
+    """
+    Streams [(name, IndexedMesh)] parts as one binary STL, part by part.
+    """
+    records = [stl_records(m) for _, m in parts]
+    # WSGI wants bytes, so each ~1MB chunk is copied once on its way out
+    chunks = (bytes(chunk) for chunk in iter_stl(records, chunk_records=STL_CHUNK_RECORDS))
+    return Response(chunks, mimetype='model/stl', direct_passthrough=True, headers={
+        'Content-Length': str(stl_size(records)),
+        'Content-Disposition': f'attachment; filename="{filename}"'
+    })
+
+def run_generate_job(data, job, profile=False):
+    payload, status = generate_from_request(data, progress=job.add_event, profile=profile)
+    if status >= 400:
+        raise RuntimeError(payload.get('error', 'Generation failed'))
+    return payload
+
+def generate_from_request(data, progress=None, profile=False, stream=False):
+    """
+    Runs a generate request end to end. Returns (payload, status_code).
+    progress, if given, receives an event dict as each stage finishes.
+    With profile=True the request skips the result cache and its sampled
+    stacks are written next to the output for flame graphs.
+    With stream=True nothing is saved and a successful payload holds the
+    mesh parts to send ({'parts', 'file_id'}).
+    """
+    start = time.perf_counter()
+    labels = {
+        'input_kind': 'image' if data.get('file_id') else 'text',
+        'outline_type': metrics.outline_label(data.get('outline_type', 'bubble'))
+    }
+    profiler = StackSampler().start() if profile else None
+    try:
+        payload, status = build_model(data, progress, labels, profiler, stream)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+    outcome = 'cached' if payload.get('cached') else str(status)
+    metrics.generate_seconds.observe(time.perf_counter() - start, status=outcome, **labels)
+    if profiler is not None:
+        name = f"{payload.get('file_id') or 'generate_' + uuid.uuid4().hex}_profile.folded"
+        samples = profiler.write(os.path.join(PROCESSING_FOLDER, name))
+        output_store.register(name, 'profile', group=artifact_group(name))
+        print(f"Profile: {samples} samples over {profiler.elapsed:.2f}s -> {name}")
+        payload = dict(payload, profile_url=f"/api/download/{name}")
+    return payload, status
+
+def run_mesh(fn, *args, profiler=None, affinity=None, **kwargs):
+    """
+    mesh_executor.run, sampling the worker process too when profiling.
+    """
+    if profiler is None or mesh_executor.workers <= 0:
+        # Inline runs are already covered by the request thread's sampler
+        return mesh_executor.run(fn, *args, affinity=affinity, **kwargs)
+    result, stacks = mesh_executor.run(profile_call, fn, *args, affinity=affinity, **kwargs)
+    profiler.add(stacks, prefix='mesh_worker')
+    return result
+
+def build_model(data, progress, labels, profiler=None, stream=False):
+    def on_event(event):
+        # Every stage lands in /api/metrics, streamed to a job or not
+        metrics.record_stage_event(event, labels)
+        if progress is not None:
+            progress(event)
+    report = StageReporter(on_event)
     file_id = data.get('file_id')
     text = data.get('text', '')
     shape_type = data.get('shape', 'cutout')
@@ -119,6 +337,17 @@ def generate_model():
     hole_y = float(data.get('hole_y', 0))
     hole_radius = float(data.get('hole_radius', 3.0))
     ai_prompt = data.get('ai_prompt', '')
+    # Text-only keychains: 'vector' uses glyph outlines, 'raster' renders and traces an image
+    text_mode = data.get('text_mode', 'vector')
+    # 'preview' for quick viewer updates, 'final' for the printable STL
+    quality = data.get('quality', 'final')
+    if quality not in QUALITY_PRESETS:
+        return {'error': f"quality must be one of {', '.join(QUALITY_PRESETS)}"}, 400
+    # 'stl': combined + part STLs; '3mf': one multi-material file
+    output_format = data.get('output_format', 'stl')
+    if output_format not in OUTPUT_FORMATS:
+        return {'error': f"output_format must be one of {', '.join(OUTPUT_FORMATS)}"}, 400
+    colors = {'base': data.get('base_color'), 'text': data.get('text_color')}
     
     ai_response_data = None
 
@@ -140,6 +369,9 @@ def generate_model():
             hole_position = ai_params.get('hole_position', hole_position)
             hole_radius = float(ai_params.get('hole_radius', hole_radius))
             
+            colors = {'base': ai_params.get('base_color', colors['base']),
+                      'text': ai_params.get('text_color', colors['text'])}
+            
             ai_response_data = {
                 'text_color': ai_params.get('text_color'),
                 'base_color': ai_params.get('base_color'),
@@ -157,79 +389,364 @@ def generate_model():
         except Exception as e:
             print(f"AI Error: {e}")
             ai_response_data = {'error': str(e)}
+        labels['outline_type'] = metrics.outline_label(outline_type)
+        report('ai')
 
     if not file_id and not text:
-        return jsonify({'error': 'Either File or Text is required'}), 400
+        return {'error': 'Either File or Text is required'}, 400
         
     input_path = None
     
     if file_id:
         # Find the file
-        for ext in ['.png', '.jpg', '.jpeg']:
-            temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{file_id}{ext}")
-            if os.path.exists(temp_path):
-                input_path = temp_path
-                break
+        input_path = find_upload(upload_store, file_id)
         if not input_path:
-            return jsonify({'error': 'File not found'}), 404
+            return {'error': 'File not found'}, 404
+        try:
+            with open(input_path, 'rb') as f:
+                source_bytes = f.read()
+        except FileNotFoundError:
+            # Deleted outside the store after the lookup
+            upload_store.remove(os.path.basename(input_path))
+            return {'error': 'File not found'}, 404
+    else:
+        font_path = get_font_path(font_name)
+        if text_mode == 'vector' and font_path is None:
+            # No TTF to read outlines from, PIL can still render its default font
+            text_mode = 'raster'
+        # Resolved path in the key, so a font filled in later doesn't reuse a substitute's result
+        source_bytes = f"text\0{text_mode}\0{font_name}\0{font_path}\0{text}".encode('utf-8')
+
+    mesh_params = {
+        'text': text,
+        'shape_type': shape_type,
+        'text_thickness': text_thickness,
+        'base_thickness': base_thickness,
+        'base_padding': base_padding,
+        'text_dilation': text_dilation,
+        'outline_type': outline_type,
+        'hole_radius': hole_radius,
+        'hole_position': hole_position,
+        'hole_x_off': hole_x,
+        'hole_y_off': hole_y,
+        'quality': quality
+    }
+    if output_format == '3mf':
+        # Colours only end up in the file (and so the cache key) for 3MF
+        mesh_params['colors'] = colors
+
+    # Identical input + params: reuse the STLs from the earlier run
+    cache_key = result_cache.make_key(source_bytes, mesh_params)
+    cached = None if profiler or stream else result_cache.get(cache_key, validate=cached_result_exists)
+    if cached:
+        response = dict(cached, message='Model generated successfully', cached=True)
+        if ai_response_data:
+            response['ai_params'] = ai_response_data
+        return response, 200
+
+    if file_id:
+        # A fresh name per generation, so a cached result never points at
+        # files a later generation from the same upload has rewritten
+        output_id = f"{file_id}_{uuid.uuid4().hex[:12]}"
     else:
         # Text Only Mode
         file_id = f"text_{uuid.uuid4()}"
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{file_id}.png")
-        create_text_image(text, input_path, font_name)
+        output_id = file_id
+        if text_mode == 'raster':
+            input_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{file_id}.png")
+            create_text_image(text, input_path, font_name)
+            upload_store.register(f"{file_id}.png", 'text_render')
+            report('text_render')
 
     try:
         # Generate STL directly
-        stl_filename = f"{file_id}.stl"
-        output_path = os.path.join(PROCESSING_FOLDER, stl_filename)
+        stl_filename = f"{output_id}.stl"
+        model_filename = f"{output_id}.{output_format}"
+        output_path = None if stream else os.path.join(PROCESSING_FOLDER, model_filename)
         
-        print(f"Processing: {input_path} -> {output_path}")
+        print(f"Processing: {input_path or 'glyph outlines'} -> {output_path}")
         print(f"Params: Shape={shape_type}, Text={text}, Font={font_name}, Thick={text_thickness}/{base_thickness}, Pad={base_padding}, Outline={outline_type}, Hole={hole_position}")
         
-        process_image_to_mesh(
-            input_path, 
-            output_path, 
-            text=text if file_id else None,
-            shape_type=shape_type,
-            text_thickness=text_thickness,
-            base_thickness=base_thickness,
-            base_padding=base_padding,
-            text_dilation=text_dilation,
-            outline_type=outline_type,
-            hole_radius=hole_radius,
-            hole_position=hole_position,
-            hole_x_off=hole_x,
-            hole_y_off=hole_y
-        )
+        # Same source -> same worker, whose stage caches hold its earlier stages
+        if input_path:
+            mesh_result = run_mesh(process_image_to_mesh, input_path, output_path, profiler=profiler,
+                                   affinity=input_path, progress=on_event, **mesh_params)
+        else:
+            mesh_result = run_mesh(process_text_to_mesh, output_path=output_path, font_name=font_name,
+                                   font_path=font_path, profiler=profiler, affinity=(text, font_path),
+                                   progress=on_event, **mesh_params)
+        if stream:
+            return {'parts': mesh_result, 'file_id': output_id}, 200
+        output_store.register(f"{output_id}.kcm", 'viewer_mesh', group=output_id)
         
-        response = {
-            'message': 'Model generated successfully',
-            'stl_url': f"/api/download/{stl_filename}",
-            'base_url': f"/api/download/{stl_filename.replace('.stl', '_base.stl')}",
-            'text_url': f"/api/download/{stl_filename.replace('.stl', '_text.stl')}",
-            'file_id': file_id
+        result = {
+            'model_url': f"/api/download/{model_filename}",
+            'mesh_url': f"/api/mesh/{output_id}.kcm",
+            'format': output_format,
+            'file_id': output_id
         }
+        if output_format == '3mf':
+            output_store.register(model_filename, 'mesh', group=output_id)
+        else:
+            for name in [stl_filename, stl_filename.replace('.stl', '_base.stl'), stl_filename.replace('.stl', '_text.stl')]:
+                output_store.register(name, 'mesh', group=output_id)
+            result.update({
+                'stl_url': f"/api/download/{stl_filename}",
+                'base_url': f"/api/download/{stl_filename.replace('.stl', '_base.stl')}",
+                'text_url': f"/api/download/{stl_filename.replace('.stl', '_text.stl')}"
+            })
+        result_cache.put(cache_key, result)
+        
+        response = dict(result, message='Model generated successfully')
         
         if ai_response_data:
             response['ai_params'] = ai_response_data
             
-        return jsonify(response)
+        return response, 200
         
     except Exception as e:
         print(f"Error generating model: {e}")
         import traceback
         traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
+
+def cached_result_exists(result):
+    # Evicted by the sweeper or deleted from disk -> regenerate
+    urls = [result[k] for k in ('model_url', 'mesh_url', 'stl_url', 'base_url', 'text_url') if k in result]
+    return all(output_store.present(url.rsplit('/', 1)[-1]) is not None for url in urls)
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+@app.route('/api/artifacts/stats', methods=['GET'])
+def artifact_stats():
+    return jsonify({'uploads': upload_store.stats(), 'outputs': output_store.stats()})
+
+metrics.registry.register(metrics.CallbackMetric(
+    'keychain_result_cache_hits_total', 'Generate requests answered from the result cache.',
+    lambda: result_cache.stats()['hits'], 'counter'))
+metrics.registry.register(metrics.CallbackMetric(
+    'keychain_result_cache_misses_total', 'Generate requests that had to build a mesh.',
+    lambda: result_cache.stats()['misses'], 'counter'))
+metrics.registry.register(metrics.CallbackMetric(
+    'keychain_ai_clients', 'Pooled OpenAI clients (one per API key).',
+    lambda: client_pool.stats()['clients']))
+metrics.registry.register(metrics.CallbackMetric(
+    'keychain_ai_client_reuses_total', 'AI calls served by an already connected client.',
+    lambda: client_pool.stats()['hits'], 'counter'))
+metrics.registry.register(metrics.CallbackMetric(
+    'keychain_upload_store_bytes', 'Bytes of uploads and renders on disk.',
+    lambda: upload_store.total_bytes))
+metrics.registry.register(metrics.CallbackMetric(
+    'keychain_output_store_bytes', 'Bytes of generated meshes on disk.',
+    lambda: output_store.total_bytes))
+
+@app.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+MAX_BATCH_TEXTS = 200
+
+@app.route('/api/generate/batch', methods=['POST'])
+def generate_batch():
+    """
+    Generates one keychain per text with a shared style and streams back a
+    ZIP of STLs, adding each entry as soon as its mesh is finished, or with
+    output_format='3mf' returns them all on one 3MF plate.
+    """
+    data = request.json
+    texts = [t for t in data.get('texts', []) if isinstance(t, str) and t.strip()]
+    if not texts:
+        return jsonify({'error': 'texts is required'}), 400
+    if len(texts) > MAX_BATCH_TEXTS:
+        return jsonify({'error': f"At most {MAX_BATCH_TEXTS} texts per batch"}), 400
+    
+    font_name = data.get('font', 'sans')
+    text_mode = data.get('text_mode', 'vector')
+    if text_mode == 'vector' and get_font_path(font_name) is None:
+        text_mode = 'raster'
+    include_parts = bool(data.get('include_parts', False))
+    output_format = data.get('output_format', 'stl')
+    if output_format not in OUTPUT_FORMATS:
+        return jsonify({'error': f"output_format must be one of {', '.join(OUTPUT_FORMATS)}"}), 400
+    mesh_params = {
+        'shape_type': data.get('shape', 'cutout'),
+        'text_thickness': float(data.get('text_thickness', 3.0)),
+        'base_thickness': float(data.get('base_thickness', 2.0)),
+        'base_padding': float(data.get('base_padding', 5.0)),
+        'text_dilation': float(data.get('text_dilation', 0.0)),
+        'outline_type': data.get('outline_type', 'bubble'),
+        'hole_radius': float(data.get('hole_radius', 3.0)),
+        'hole_position': data.get('hole_position', 'top'),
+        'hole_x_off': float(data.get('hole_x', 0)),
+        'hole_y_off': float(data.get('hole_y', 0))
+    }
+    batch_id = f"batch_{uuid.uuid4()}"
+    if output_format == '3mf':
+        colors = {'base': data.get('base_color'), 'text': data.get('text_color')}
+        return batch_plate(texts, font_name, text_mode, mesh_params, batch_id, colors)
+    
+    def entries():
+        names = set()
+        pool = ThreadPoolExecutor(max_workers=max(1, mesh_executor.workers))
+        try:
+            futures = {}
+            for i, text in enumerate(texts):
+                output_path = os.path.join(PROCESSING_FOLDER, f"{batch_id}_{i}.stl")
+                future = pool.submit(generate_batch_item, text, font_name, text_mode, mesh_params, output_path)
+                futures[future] = (text, output_path)
+            
+            for future in as_completed(futures):
+                text, output_path = futures[future]
+                name = unique_entry_name(text, names)
+                part_paths = [output_path.replace('.stl', '_base.stl'), output_path.replace('.stl', '_text.stl')]
+                viewer_path = output_path.replace('.stl', '.kcm')
+                try:
+                    future.result()
+                    yield f"{name}.stl", output_path
+                    if include_parts:
+                        for part, path in zip(('base', 'text'), part_paths):
+                            if os.path.exists(path):
+                                yield f"{name}_{part}.stl", path
+                except Exception as e:
+                    print(f"Batch error for {text!r}: {e}")
+                    yield f"{name}.error.txt", str(e).encode('utf-8')
+                finally:
+                    for path in [output_path, viewer_path] + part_paths:
+                        if os.path.exists(path):
+                            os.remove(path)
+        finally:
+            # Client gone or batch done: drop pending work and leftover files
+            pool.shutdown(wait=True, cancel_futures=True)
+            for path in glob.glob(os.path.join(PROCESSING_FOLDER, f"{batch_id}_*")):
+                os.remove(path)
+    
+    return Response(stream_zip(entries()), mimetype='application/zip', headers={
+        'Content-Disposition': f'attachment; filename="{batch_id}.zip"'
+    })
 
-@app.route('/api/preview', methods=['POST'])
+# Space between keychains on a batch plate, in the meshes' XY units (px)
+PLATE_GAP = 5 * PX_PER_MM
+
+def batch_plate(texts, font_name, text_mode, mesh_params, batch_id, colors):
+    """
+    Every keychain of a batch on one 3MF plate. Unlike the ZIP this can't
+    stream: the plate's model file needs all the meshes. Texts that fail
+    are left off and counted in X-Batch-Failed.
+    """
+    keychains = []
+    names = set()
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, mesh_executor.workers)) as pool:
+        futures = [pool.submit(generate_batch_item, text, font_name, text_mode, mesh_params, None,
+                               os.path.join(PROCESSING_FOLDER, f"{batch_id}_{i}.png"))
+                   for i, text in enumerate(texts)]
+        for text, future in zip(texts, futures):
+            name = unique_entry_name(text, names)
+            try:
+                keychains.append((name, future.result()))
+            except Exception as e:
+                print(f"Batch error for {text!r}: {e}")
+                failed += 1
+    if not keychains:
+        return jsonify({'error': 'None of the texts could be generated'}), 500
+    buf = io.BytesIO()
+    write_3mf_plate(buf, keychains, colors, offsets=plate_layout(keychains, PLATE_GAP))
+    return Response(buf.getvalue(), mimetype='model/3mf', headers={
+        'Content-Disposition': f'attachment; filename="{batch_id}.3mf"',
+        'X-Batch-Failed': str(failed)
+    })
+
+def generate_batch_item(text, font_name, text_mode, mesh_params, output_path, render_path=None):
+    """
+    Builds one batch keychain. With output_path=None nothing is written and
+    its [(name, IndexedMesh)] parts are returned; raster text is rendered
+    to render_path (default: next to output_path).
+    """
+    if text_mode == 'raster':
+        input_path = render_path or output_path.replace('.stl', '.png')
+        create_text_image(text, input_path, font_name)
+        try:
+            return mesh_executor.run(process_image_to_mesh, input_path, output_path, text=text, **mesh_params)
+        finally:
+            os.remove(input_path)
+    return mesh_executor.run(process_text_to_mesh, text, output_path, font_name=font_name,
+                             font_path=get_font_path(font_name), **mesh_params)
+
+def unique_entry_name(text, names):
+    base = secure_filename(text) or 'keychain'
+    name = base
+    n = 2
+    while name in names:
+        name = f"{base}_{n}"
+        n += 1
+    names.add(name)
+    return name
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+# Comment line sent while a stage is running, so proxies keep the stream open
+SSE_HEARTBEAT_SECONDS = 15
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """
+    Server-Sent Events stream of a job's stage progress, ending with a
+    'done'/'failed'/'cancelled' event that carries the job status.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    def stream():
+        sent = 0
+        while True:
+            events, finished = job.wait_events(sent, timeout=SSE_HEARTBEAT_SECONDS)
+            for event in events:
+                yield f"event: stage\ndata: {json.dumps(event)}\n\n"
+            sent += len(events)
+            if finished:
+                yield f"event: {job.state}\ndata: {json.dumps(job.to_dict())}\n\n"
+                return
+            if not events:
+                yield ": heartbeat\n\n"
+    
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/preview', methods=['GET', 'POST'])
 def preview_image():
     try:
-        data = request.json
+        # GET (or POST with inline) returns the image itself instead of a URL
+        data = request.args if request.method == 'GET' else request.json
         text = data.get('text', '')
         font_name = data.get('font', 'sans')
         
         if not text:
             return jsonify({'error': 'Text is required for preview'}), 400
+        if request.method == 'GET' or data.get('inline'):
+            if len(text) > PREVIEW_MAX_TEXT:
+                return jsonify({'error': f"Preview text is limited to {PREVIEW_MAX_TEXT} characters"}), 400
+            try:
+                size = int(data.get('size') or PREVIEW_FONT_SIZE)
+            except (TypeError, ValueError):
+                return jsonify({'error': 'size must be a whole number of pixels'}), 400
+            return inline_preview(text, font_name, size, data.get('format'))
             
         # Generate preview image
         preview_id = f"preview_{uuid.uuid4()}"
@@ -237,6 +754,7 @@ def preview_image():
         output_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         
         create_text_image(text, output_path, font_name)
+        upload_store.register(filename, 'preview')
         
         return jsonify({
             'preview_url': f"/api/download_image/{filename}",
@@ -248,11 +766,90 @@ def preview_image():
 
 @app.route('/api/download_image/<filename>', methods=['GET'])
 def download_image(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return send_artifact(upload_store, filename)
 
 @app.route('/api/download/<filename>', methods=['GET'])
 def download_file(filename):
-    return send_from_directory(PROCESSING_FOLDER, filename, as_attachment=True)
+    return send_artifact(output_store, filename, as_attachment=True)
+
+@app.route('/api/mesh/<filename>', methods=['GET'])
+def download_viewer_mesh(filename):
+    """
+    Indexed, quantized base + text meshes for the viewer (see
+    mesh_export.py), gzipped when the client accepts it.
+    """
+    if not filename.endswith('.kcm'):
+        return jsonify({'error': 'File not found'}), 404
+    return send_artifact(output_store, filename, mimetype='application/octet-stream')
+
+# Every generation, upload and preview is written under a fresh name, so clients may keep them
+ARTIFACT_MAX_AGE = 365 * 24 * 3600
+# Sent compressed when the client accepts it; the rest are already compressed
+COMPRESSIBLE = ('.stl', '.kcm', '.folded', '.json')
+
+def gzip_file(src, dst):
+    with open(src, 'rb') as f_in, open(dst, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=9, mtime=0) as f_out:
+        shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+
+def brotli_file(src, dst):
+    with open(src, 'rb') as f_in, open(dst, 'wb') as f_out:
+        f_out.write(brotli.compress(f_in.read(), quality=9))
+
+# In order of preference when the client accepts several equally
+SIDECARS = {}
+if brotli is not None:
+    SIDECARS['br'] = ('.br', brotli_file)
+SIDECARS['gzip'] = ('.gz', gzip_file)
+
+def send_artifact(store, filename, as_attachment=False, mimetype=None):
+    """
+    Serves an indexed artifact with a content-hash ETag and immutable
+    caching. Compressible files are sent from a gzip/brotli sidecar built
+    on first request. Conditional and Range requests are answered against
+    whichever representation is sent. Small files come from memory.
+    """
+    artifact = store.present(filename)
+    if artifact is None:
+        return jsonify({'error': 'File not found'}), 404
+    mimetype = mimetype or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    
+    encoding = None
+    served = artifact
+    compressible = filename.endswith(COMPRESSIBLE)
+    try:
+        if compressible:
+            encoding = request.accept_encodings.best_match(list(SIDECARS))
+            if encoding:
+                suffix, build = SIDECARS[encoding]
+                served = store.variant(filename, suffix, build) or artifact
+                if served is artifact:
+                    encoding = None
+        etag = store.etag(served)
+        
+        data = store.read(served.id)
+        if data is not None:
+            rv = Response(data, mimetype=mimetype)
+            rv.set_etag(etag)
+            rv = rv.make_conditional(request, accept_ranges=True, complete_length=len(data))
+        else:
+            rv = send_file(served.path, mimetype=mimetype, etag=etag, conditional=True)
+    except FileNotFoundError:
+        # Deleted outside the store since the check above
+        store.remove(served.id)
+        store.present(filename)
+        return jsonify({'error': 'File not found'}), 404
+    
+    if encoding:
+        rv.headers['Content-Encoding'] = encoding
+    if compressible:
+        rv.vary.add('Accept-Encoding')
+    if as_attachment:
+        rv.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    rv.cache_control.public = True
+    rv.cache_control.max_age = ARTIFACT_MAX_AGE
+    rv.cache_control.immutable = True
+    rv.cache_control.no_cache = None
+    return rv
 
 @app.route('/api/chat', methods=['POST'])
 def ai_chat():
@@ -272,4 +869,7 @@ def ai_chat():
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
+    # With the debug reloader, only the serving child should start workers
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        mesh_executor.warm()
     app.run(host='0.0.0.0', port=5001, debug=True)
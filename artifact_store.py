@@ -0,0 +1,307 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+class Artifact:
+    __slots__ = ('id', 'path', 'kind', 'group', 'size', 'created', 'last_access', 'etag')
+
+    def __init__(self, artifact_id, path, kind, group, size, created):
+        self.id = artifact_id
+        self.path = path
+        self.kind = kind
+        self.group = group
+        self.size = size
+        self.created = created
+        self.last_access = created
+        self.etag = None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'group': self.group,
+            'size': self.size,
+            'created': self.created,
+            'last_access': self.last_access
+        }
+
+class ArtifactStore:
+    """
+    Index of the files in one folder (id = file name), so lookups are a
+    dict hit instead of probing the disk. Entries are kept in LRU order;
+    a background sweeper deletes groups (e.g. an STL and its parts) that
+    are older than ttl seconds since last access, then least recently used
+    groups until the folder is under max_bytes. Files up to memory_item_bytes
+    are also kept in memory, within memory_bytes in total, when read.
+    """
+    def __init__(self, folder, max_bytes, ttl=None, memory_bytes=0, memory_item_bytes=256 * 1024,
+                 sweep_interval=60, classify=None):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.memory_bytes = memory_bytes
+        self.memory_item_bytes = memory_item_bytes
+        self.sweep_interval = sweep_interval
+        # classify(name) -> (kind, group) for files found by scan()
+        self.classify = classify or (lambda name: ('file', name))
+        self.lock = threading.Lock()
+        self.index = OrderedDict()
+        self.groups = {}
+        self.total_bytes = 0
+        self.memory = OrderedDict()
+        self.memory_used = 0
+        # source id -> ids of its variants (e.g. .gz copies)
+        self.variants = {}
+        self.evictions = 0
+        self.memory_hits = 0
+        self.wake = threading.Event()
+        self.sweeper = None
+
+    def path(self, artifact_id):
+        return os.path.join(self.folder, artifact_id)
+
+    def register(self, artifact_id, kind, group=None):
+        """
+        Indexes a file that was just written to the folder. Returns the
+        Artifact, or None if the file doesn't exist. Re-registering a
+        rewritten file deletes the variants built from its old contents.
+        """
+        path = self.path(artifact_id)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        artifact = Artifact(artifact_id, path, kind, group or artifact_id, st.st_size, time.time())
+        with self.lock:
+            stale = [self.drop(v) for v in self.variants.pop(artifact_id, ())]
+            self.drop(artifact_id)
+            self.index[artifact_id] = artifact
+            self.groups.setdefault(artifact.group, set()).add(artifact_id)
+            self.total_bytes += artifact.size
+            over_quota = self.total_bytes > self.max_bytes
+        for old in stale:
+            if old is not None:
+                self.unlink(old.path)
+        self.start()
+        if over_quota:
+            self.wake.set()
+        return artifact
+
+    def scan(self):
+        """
+        Indexes files already on disk (e.g. left by a previous run), oldest
+        first so they are the first to be evicted.
+        """
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and not entry.name.endswith('.part'):
+                st = entry.stat()
+                entries.append((st.st_mtime, entry.name, st.st_size))
+        with self.lock:
+            for mtime, name, size in sorted(entries):
+                if name in self.index:
+                    continue
+                kind, group = self.classify(name)
+                artifact = Artifact(name, self.path(name), kind, group, size, mtime)
+                self.index[name] = artifact
+                self.groups.setdefault(group, set()).add(name)
+                self.total_bytes += size
+        self.start()
+        self.wake.set()
+        return len(entries)
+
+    def get(self, artifact_id):
+        """
+        The indexed Artifact for an id (refreshing its last access), or None.
+        """
+        with self.lock:
+            artifact = self.index.get(artifact_id)
+            if artifact is not None:
+                artifact.last_access = time.time()
+                self.index.move_to_end(artifact_id)
+            return artifact
+
+    def resolve(self, artifact_id):
+        artifact = self.present(artifact_id)
+        return artifact.path if artifact else None
+
+    def present(self, artifact_id):
+        """
+        Like get, but also checks the file is still on disk; a file deleted
+        outside the store (e.g. a tmp cleaner) is dropped from the index.
+        """
+        artifact = self.get(artifact_id)
+        if artifact is not None and not os.path.exists(artifact.path):
+            self.remove(artifact_id)
+            return None
+        return artifact
+
+    def read(self, artifact_id):
+        """
+        Contents of a small artifact from memory (loading it on first use),
+        or None if it isn't indexed or is too big to hold in memory.
+        """
+        artifact = self.get(artifact_id)
+        if artifact is None or not self.memory_bytes or artifact.size > self.memory_item_bytes:
+            return None
+        with self.lock:
+            data = self.memory.get(artifact_id)
+            if data is not None:
+                self.memory.move_to_end(artifact_id)
+                self.memory_hits += 1
+                return data
+        try:
+            with open(artifact.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.remove(artifact_id)
+            return None
+        with self.lock:
+            if self.index.get(artifact_id) is artifact and artifact_id not in self.memory:
+                self.memory[artifact_id] = data
+                self.memory_used += len(data)
+                while self.memory_used > self.memory_bytes:
+                    _, old = self.memory.popitem(last=False)
+                    self.memory_used -= len(old)
+        return data
+
+    def etag(self, artifact):
+        """
+        Content hash of an artifact, computed on first use. A rewritten
+        file must be registered again, which makes a new record.
+        """
+        if artifact.etag is None:
+            digest = hashlib.sha256()
+            with open(artifact.path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+            artifact.etag = digest.hexdigest()[:32]
+        return artifact.etag
+
+    def variant(self, artifact_id, suffix, build, kind='sidecar'):
+        """
+        Derived file artifact_id + suffix (e.g. a .gz copy), made with
+        build(src_path, dst_path) the first time it is asked for and kept
+        in the source's group so they are evicted together.
+        """
+        variant_id = artifact_id + suffix
+        artifact = self.get(variant_id)
+        if artifact is not None:
+            with self.lock:
+                # Also links variants found by scan() to their source
+                if artifact_id in self.index:
+                    self.variants.setdefault(artifact_id, set()).add(variant_id)
+            return artifact
+        source = self.get(artifact_id)
+        if source is None:
+            return None
+        # Concurrent builders each write their own temp file; last rename wins
+        tmp = f"{self.path(variant_id)}.{threading.get_ident()}.part"
+        build(source.path, tmp)
+        with self.lock:
+            current = self.index.get(artifact_id) is source
+        if not current:
+            # Source was rewritten or evicted while building
+            self.unlink(tmp)
+            return None
+        os.replace(tmp, self.path(variant_id))
+        artifact = self.register(variant_id, kind, group=source.group)
+        with self.lock:
+            self.variants.setdefault(artifact_id, set()).add(variant_id)
+        return artifact
+
+    def remove(self, artifact_id):
+        with self.lock:
+            artifact = self.drop(artifact_id)
+        if artifact is not None:
+            self.unlink(artifact.path)
+
+    def drop(self, artifact_id):
+        # Caller holds self.lock; forgets an entry without touching the disk
+        artifact = self.index.pop(artifact_id, None)
+        if artifact is None:
+            return None
+        self.variants.pop(artifact_id, None)
+        self.total_bytes -= artifact.size
+        members = self.groups.get(artifact.group)
+        if members is not None:
+            members.discard(artifact_id)
+            if not members:
+                del self.groups[artifact.group]
+        data = self.memory.pop(artifact_id, None)
+        if data is not None:
+            self.memory_used -= len(data)
+        return artifact
+
+    @staticmethod
+    def unlink(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def sweep(self):
+        """
+        Evicts expired groups, then least recently used groups while over
+        quota. Returns the number of files deleted.
+        """
+        now = time.time()
+        doomed = []
+        with self.lock:
+            evict_groups = set()
+            if self.ttl:
+                evict_groups.update(a.group for a in self.index.values() if now - a.last_access > self.ttl)
+            remaining = self.total_bytes - sum(
+                self.index[i].size for g in evict_groups for i in self.groups.get(g, ()))
+            for artifact in self.index.values():
+                if remaining <= self.max_bytes:
+                    break
+                if artifact.group in evict_groups:
+                    continue
+                evict_groups.add(artifact.group)
+                remaining -= sum(self.index[i].size for i in self.groups.get(artifact.group, ()))
+            for group in evict_groups:
+                for artifact_id in list(self.groups.get(group, ())):
+                    doomed.append(self.drop(artifact_id))
+            self.evictions += len(doomed)
+        # Unlink outside the lock; open readers keep their file handles
+        for artifact in doomed:
+            self.unlink(artifact.path)
+        if doomed:
+            print(f"Artifact sweep {self.folder}: evicted {len(doomed)} files")
+        return len(doomed)
+
+    def start(self):
+        # Sweeper starts on first register() or scan(), never on construction
+        with self.lock:
+            if self.sweeper is not None:
+                return
+            self.sweeper = threading.Thread(target=self.run_sweeper, name='artifact-sweeper', daemon=True)
+            self.sweeper.start()
+
+    def run_sweeper(self):
+        while True:
+            self.wake.wait(self.sweep_interval)
+            self.wake.clear()
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Artifact sweep error: {e}")
+
+    def stats(self):
+        with self.lock:
+            kinds = {}
+            for artifact in self.index.values():
+                kinds[artifact.kind] = kinds.get(artifact.kind, 0) + 1
+            return {
+                'files': len(self.index),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'kinds': kinds,
+                'evictions': self.evictions,
+                'memory_files': len(self.memory),
+                'memory_bytes': self.memory_used,
+                'memory_hits': self.memory_hits
+            }
@@ -0,0 +1,253 @@
+"""
+Benchmark for the image-to-mesh pipeline.
+
+Runs a fixed corpus (short and long texts in every installed FONT_MAP font
+rendered with create_text_image, plus synthetic high-contour silhouettes) through
+process_image_to_mesh for every outline_type / hole_position combination.
+Reports per-stage wall time, peak memory, vertex and triangle counts, writes
+the results as JSON and exits non-zero when a case is slower than the stored
+baseline by more than the regression threshold, or fails where the baseline
+ran. Every case, plus glyph
+outlines of WATERTIGHT_TEXTS in every font, must also come out watertight
+(each directed edge has its reverse).
+
+    python benchmarks/bench_pipeline.py --output bench.json
+    python benchmarks/bench_pipeline.py --baseline baseline.json --threshold 0.25
+    python benchmarks/bench_pipeline.py --quick --update-baseline baseline.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+from font_manager import FONT_MAP, font_registry
+from text_render import create_text_image
+from mesh_generator import process_image_to_mesh, process_text_to_mesh, clear_stage_caches
+
+SHORT_TEXT = 'Mia'
+LONG_TEXT = 'Alexandra Montgomery'
+OUTLINE_TYPES = ['bubble', 'rect', 'none']
+HOLE_POSITIONS = ['top', 'left', 'right', 'bottom', 'custom', 'none']
+# Glyphs whose unions have holes touching the outline at a vertex
+WATERTIGHT_TEXTS = ['8', 'B', 'R', 'Mom & Dad']
+
+def synthetic_silhouette(path, seed, blobs=400, size=1600):
+    """
+    Noisy silhouette with many small blobs and holes, which stresses
+    contour tracing, unions and triangulation.
+    """
+    rng = np.random.default_rng(seed)
+    img = np.full((size, size), 255, np.uint8)
+    cv2.circle(img, (size // 2, size // 2), size // 3, 0, -1)
+    for _ in range(blobs):
+        x, y = rng.integers(50, size - 50, 2)
+        r = int(rng.integers(4, 30))
+        cv2.circle(img, (int(x), int(y)), r, int(rng.choice([0, 255])), -1)
+    pts = rng.integers(100, size - 100, (60, 2)).astype(np.int32)
+    cv2.polylines(img, [pts], True, 0, 3)
+    cv2.imwrite(path, img)
+
+def installed_fonts():
+    """
+    FONT_MAP fonts on disk. Missing ones would silently render a fallback
+    font under the missing font's name, so they are left out.
+    """
+    fonts = [name for name in FONT_MAP if font_registry.get_path(name)]
+    skipped = [name for name in FONT_MAP if name not in fonts]
+    if skipped:
+        print(f"Skipping fonts not installed: {', '.join(skipped)}")
+    return fonts
+
+def build_corpus(workdir, fonts, quick=False):
+    corpus = []
+    fonts = fonts[:2] if quick else fonts
+    texts = [SHORT_TEXT] if quick else [SHORT_TEXT, LONG_TEXT]
+    for font_name in fonts:
+        for text in texts:
+            name = f"text-{font_name}-{len(text)}"
+            path = os.path.join(workdir, f"{name}.png")
+            create_text_image(text, path, font_name)
+            corpus.append((name, path))
+    for seed in ([1] if quick else [1, 2]):
+        name = f"silhouette-{seed}"
+        path = os.path.join(workdir, f"{name}.png")
+        synthetic_silhouette(path, seed)
+        corpus.append((name, path))
+    return corpus
+
+def run_once(image_path, output_path, params, trace_memory=False):
+    events = []
+    clear_stage_caches()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        process_image_to_mesh(image_path, output_path, progress=events.append, **params)
+    finally:
+        total = time.perf_counter() - start
+        peak = None
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return total, peak, events
+
+def run_case(image_path, output_path, params, repeats):
+    totals = []
+    stage_times = {}
+    events = []
+    for _ in range(repeats):
+        total, _, events = run_once(image_path, output_path, params)
+        totals.append(total)
+        for e in events:
+            stage_times.setdefault(e['stage'], []).append(e['duration'])
+    # Separate pass for memory: tracing slows allocation-heavy stages
+    _, peak, _ = run_once(image_path, output_path, params, trace_memory=True)
+    counts = {e['stage']: {k: e[k] for k in ('vertices', 'triangles') if k in e} for e in events}
+    parts = process_image_to_mesh(image_path, None, **params)
+    return {
+        'open_edges': sum(open_edges(m) for _, m in parts),
+        'total_s': statistics.median(totals),
+        'stages_s': {stage: statistics.median(t) for stage, t in stage_times.items()},
+        'peak_memory_bytes': peak,
+        'vertices': counts.get('triangulation', {}).get('vertices'),
+        'triangles': counts.get('save', {}).get('triangles'),
+    }
+
+def open_edges(m):
+    """
+    Directed edges of an IndexedMesh with no reverse edge (0 if watertight).
+    """
+    f = m.faces
+    edges = np.concatenate([f[:, [0, 1]], f[:, [1, 2]], f[:, [2, 0]]])
+    directed = set(map(tuple, edges.tolist()))
+    return sum((b, a) not in directed for a, b in directed)
+
+def check_glyphs(fonts, quality):
+    """
+    Returns (case, open edge count) for glyph-outline meshes that aren't
+    watertight.
+    """
+    failures = []
+    for font_name in fonts:
+        for text in WATERTIGHT_TEXTS:
+            for outline_type in OUTLINE_TYPES:
+                case = f"glyphs-{font_name}-{text}/{outline_type}"
+                parts = process_text_to_mesh(text, None, font_name=font_name,
+                                             outline_type=outline_type, quality=quality)
+                count = sum(open_edges(m) for _, m in parts)
+                if count:
+                    failures.append((case, count))
+    return failures
+
+def compare(results, baseline, threshold):
+    """
+    Returns the cases whose median total time exceeds baseline * (1 + threshold),
+    and those that now fail but passed in the baseline (with None as time).
+    """
+    regressions = []
+    for case, r in results.items():
+        base = baseline.get(case)
+        if base is None or base.get('error'):
+            continue
+        if r.get('error'):
+            regressions.append((case, base['total_s'], None))
+            continue
+        limit = base['total_s'] * (1 + threshold)
+        if r['total_s'] > limit:
+            regressions.append((case, base['total_s'], r['total_s']))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default='bench_output.json', help='where to write results')
+    parser.add_argument('--baseline', help='results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed slowdown vs baseline, as a fraction (default 0.25)')
+    parser.add_argument('--repeats', type=int, default=3, help='timed runs per case (median reported)')
+    parser.add_argument('--quick', action='store_true', help='small corpus for a fast smoke run')
+    parser.add_argument('--update-baseline', metavar='PATH', help='also write results as the new baseline')
+    parser.add_argument('--quality', choices=['final', 'preview'], default='final', help='mesh quality preset')
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        fonts = installed_fonts()
+        corpus = build_corpus(workdir, fonts, quick=args.quick)
+        output_path = os.path.join(workdir, 'out.stl')
+        for name, image_path in corpus:
+            for outline_type in OUTLINE_TYPES:
+                # Without a base there's nothing to put a hole in
+                holes = ['none'] if outline_type == 'none' else HOLE_POSITIONS
+                for hole_position in holes:
+                    case = f"{name}/{outline_type}/{hole_position}"
+                    params = {'outline_type': outline_type, 'hole_position': hole_position,
+                              'hole_x_off': 5.0, 'hole_y_off': 5.0, 'quality': args.quality}
+                    try:
+                        results[case] = run_case(image_path, output_path, params, args.repeats)
+                    except Exception as e:
+                        results[case] = {'error': str(e)}
+                    r = results[case]
+                    if 'error' in r:
+                        print(f"{case:55s} ERROR {r['error']}")
+                    else:
+                        print(f"{case:55s} {r['total_s'] * 1000:8.1f} ms  "
+                              f"{(r['peak_memory_bytes'] or 0) / 1e6:7.1f} MB  "
+                              f"{r['vertices']:>7} v  {r['triangles']:>7} tri")
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'repeats': args.repeats,
+            'quick': args.quick,
+            'quality': args.quality,
+            'timestamp': time.time()
+        },
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"Wrote {args.output}")
+    leaks = [(case, r['open_edges']) for case, r in results.items() if r.get('open_edges')]
+    glyph_fonts = fonts
+    if args.quick:
+        # Fredoka has the touching-hole glyphs WATERTIGHT_TEXTS is about
+        glyph_fonts = fonts[:2] + (['fredoka'] if 'fredoka' in fonts[2:] else [])
+    leaks += check_glyphs(glyph_fonts, args.quality)
+    for case, count in leaks:
+        print(f"OPEN MESH {case}: {count} directed edges without a reverse")
+    if args.update_baseline:
+        with open(args.update_baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Wrote baseline {args.update_baseline}")
+
+    if leaks:
+        print(f"{len(leaks)} case(s) produced meshes that aren't watertight")
+        return 1
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for case, before, after in regressions:
+            if after is None:
+                print(f"REGRESSION {case}: {before * 1000:.1f} ms -> ERROR {results[case]['error']}")
+            else:
+                print(f"REGRESSION {case}: {before * 1000:.1f} ms -> {after * 1000:.1f} ms")
+        if regressions:
+            print(f"{len(regressions)} case(s) failing or slower than baseline by more than {args.threshold:.0%}")
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
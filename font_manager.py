@@ -2,6 +2,7 @@ import os
 import urllib.request
 import json
 import ssl
+import threading
 
 # Allow legacy SSL if needed (for some older python envs)
 ssl._create_default_https_context = ssl._create_unverified_context
@@ -25,6 +26,12 @@ FONT_MAP = {
     'serif': ('playfair-display', '700', 'PlayfairDisplay-Bold.ttf')
 }
 
+# Substitutes, in order, while a requested font is missing
+FALLBACK_FONTS = ['sans', 'rounded', 'fredoka']
+
+# First bytes of TrueType / OpenType files
+TTF_MAGICS = (b'\x00\x01\x00\x00', b'true', b'OTTO')
+
 def get_font_url(font_id, variant):
     """
     Fetches the TTF URL from gwfh.mranftl.com API.
@@ -48,28 +55,153 @@ def get_font_url(font_id, variant):
         print(f"Error fetching API for {font_id}: {e}")
         return None
 
-def get_font_path(font_name):
+def download_font(font_name, font_path):
     """
-    Returns the path to the requested font. Downloads it if not present.
+    Downloads a FONT_MAP font to font_path via a temp file and atomic rename,
+    so readers never see a partial TTF.
     """
-    if font_name not in FONT_MAP:
-        font_name = 'sans' # Fallback
-        
     font_id, variant, filename = FONT_MAP[font_name]
-    font_path = os.path.join(FONTS_DIR, filename)
+    url = get_font_url(font_id, variant)
+    if not url:
+        raise RuntimeError(f"Failed to get URL for {font_name}")
+    print(f"Downloading font: {font_name} ({filename}) from {url}")
     
-    if not os.path.exists(font_path):
-        print(f"Downloading font: {font_name} ({filename})...")
-        try:
-            url = get_font_url(font_id, variant)
-            if url:
-                print(f"  Source: {url}")
-                urllib.request.urlretrieve(url, font_path)
+    tmp_path = f"{font_path}.part-{os.getpid()}-{threading.get_ident()}"
+    try:
+        urllib.request.urlretrieve(url, tmp_path)
+        with open(tmp_path, 'rb') as f:
+            magic = f.read(4)
+        if magic not in TTF_MAGICS:
+            raise RuntimeError(f"Downloaded file for {font_name} is not a font")
+        os.replace(tmp_path, font_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+class FontRegistry:
+    """
+    In-memory view of FONT_MAP: which fonts are on disk, which are missing.
+    Lookups never touch the network; missing fonts are filled in by a
+    background thread with one download per font at a time.
+    """
+    def __init__(self, fonts_dir=FONTS_DIR):
+        self.fonts_dir = fonts_dir
+        self.lock = threading.Lock()
+        self.status = {}
+        self.inflight = {}
+        self.on_ready = []
+
+    def warm(self, download_missing=True, on_ready=None):
+        """
+        Checks every FONT_MAP font on disk and records it. Missing fonts are
+        downloaded in the background if download_missing is set. on_ready is
+        called with (font_name, path) for each available font, now or later.
+        """
+        if on_ready:
+            self.on_ready.append(on_ready)
+        missing = []
+        for font_name, (_, _, filename) in FONT_MAP.items():
+            font_path = os.path.join(self.fonts_dir, filename)
+            if os.path.exists(font_path):
+                self.mark_ready(font_name, font_path)
             else:
-                print(f"  Failed to get URL for {font_name}")
-                return None
+                with self.lock:
+                    self.status.setdefault(font_name, {'state': 'missing', 'path': None, 'error': None})
+                missing.append(font_name)
+        if missing and download_missing:
+            t = threading.Thread(target=self.fill_missing, args=(missing,), daemon=True)
+            t.start()
+        return missing
+
+    def mark_ready(self, font_name, font_path):
+        with self.lock:
+            self.status[font_name] = {'state': 'ready', 'path': font_path, 'error': None}
+            callbacks = list(self.on_ready)
+        for cb in callbacks:
+            try:
+                cb(font_name, font_path)
+            except Exception as e:
+                print(f"Font preload error for {font_name}: {e}")
+
+    def fill_missing(self, font_names):
+        for font_name in font_names:
+            try:
+                self.ensure(font_name)
+            except Exception as e:
+                print(f"Failed to download font {font_name}: {e}")
+
+    def ensure(self, font_name):
+        """
+        Makes sure a font is on disk, downloading it if needed. Concurrent
+        callers for the same font share a single download (single-flight).
+        """
+        font_path = os.path.join(self.fonts_dir, FONT_MAP[font_name][2])
+        with self.lock:
+            if self.status.get(font_name, {}).get('state') == 'ready':
+                return font_path
+            event = self.inflight.get(font_name)
+            leader = event is None
+            if leader:
+                event = threading.Event()
+                self.inflight[font_name] = event
+                self.status[font_name] = {'state': 'downloading', 'path': None, 'error': None}
+        
+        if not leader:
+            event.wait()
+            return self.get_path(font_name)
+        
+        try:
+            if not os.path.exists(font_path):
+                download_font(font_name, font_path)
+            self.mark_ready(font_name, font_path)
+            return font_path
         except Exception as e:
-            print(f"Failed to download font {font_name}: {e}")
+            with self.lock:
+                self.status[font_name] = {'state': 'failed', 'path': None, 'error': str(e)}
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[font_name]
+            event.set()
+
+    def get_path(self, font_name):
+        entry = self.status.get(font_name)
+        if entry is None or entry['state'] == 'missing':
+            # Not warmed yet, or missing at warm-up and perhaps downloaded since
+            # by another process: a disk check is still cheap and offline
+            font_path = os.path.join(self.fonts_dir, FONT_MAP[font_name][2])
+            if os.path.exists(font_path):
+                self.mark_ready(font_name, font_path)
+                return font_path
             return None
-            
+        return entry['path']
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                name: {
+                    'state': entry['state'],
+                    'file': FONT_MAP[name][2],
+                    'error': entry['error']
+                }
+                for name, entry in self.status.items()
+            }
+
+font_registry = FontRegistry()
+
+def get_font_path(font_name):
+    """
+    Returns the path to the requested font, or None if it is not available
+    (yet). Served from the registry, never downloads.
+    """
+    if font_name not in FONT_MAP:
+        font_name = 'sans' # Fallback
+        
+    font_path = font_registry.get_path(font_name)
+    if font_path is None:
+        # Not on disk (yet): substitute the first available font
+        for fallback in FALLBACK_FONTS:
+            font_path = font_registry.get_path(fallback)
+            if font_path:
+                break
     return font_path
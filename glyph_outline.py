@@ -0,0 +1,211 @@
+import math
+import threading
+from functools import lru_cache
+import numpy as np
+import shapely
+from shapely.affinity import translate, scale as scale_geometry
+from fontTools.ttLib import TTFont
+from fontTools.pens.basePen import BasePen
+
+# Em size in px, matches the font size used by create_text_image so both text
+# paths produce outlines at the same scale
+FONT_SIZE_PX = 200
+# Extra px between lines, as PIL's multiline default
+LINE_SPACING_PX = 4
+# Entries kept in the per-(font, glyph) outline cache
+GLYPH_CACHE_SIZE = 2048
+
+# fontTools loads tables lazily and is not safe to decompile from two threads
+font_lock = threading.Lock()
+
+class FlattenPen(BasePen):
+    """
+    Collects glyph contours as point lists, flattening quadratic and cubic
+    curves into line segments no further than `tolerance` from the curve.
+    """
+    def __init__(self, glyph_set, tolerance):
+        super().__init__(glyph_set)
+        self.tolerance = tolerance
+        self.contours = []
+        self.current = None
+
+    def _moveTo(self, pt):
+        self.current = [pt]
+
+    def _lineTo(self, pt):
+        self.current.append(pt)
+
+    def _qCurveToOne(self, pt1, pt2):
+        p0 = np.array(self._getCurrentPoint(), dtype=np.float64)
+        p1, p2 = np.array(pt1, dtype=np.float64), np.array(pt2, dtype=np.float64)
+        # Chord error of n segments is |p0 - 2p1 + p2| / (4 n^2)
+        d = np.linalg.norm(p0 - 2 * p1 + p2)
+        n = max(1, math.ceil(math.sqrt(d / (4 * self.tolerance))))
+        t = np.linspace(0, 1, n + 1)[1:, None]
+        pts = (1 - t) ** 2 * p0 + 2 * (1 - t) * t * p1 + t ** 2 * p2
+        self.current.extend(map(tuple, pts))
+
+    def _curveToOne(self, pt1, pt2, pt3):
+        p0 = np.array(self._getCurrentPoint(), dtype=np.float64)
+        p1, p2, p3 = (np.array(p, dtype=np.float64) for p in (pt1, pt2, pt3))
+        # Chord error of n segments is at most 3 * max second difference / (4 n^2)
+        d = max(np.linalg.norm(p0 - 2 * p1 + p2), np.linalg.norm(p1 - 2 * p2 + p3))
+        n = max(1, math.ceil(math.sqrt(3 * d / (4 * self.tolerance))))
+        t = np.linspace(0, 1, n + 1)[1:, None]
+        pts = ((1 - t) ** 3 * p0 + 3 * (1 - t) ** 2 * t * p1 +
+               3 * (1 - t) * t ** 2 * p2 + t ** 3 * p3)
+        self.current.extend(map(tuple, pts))
+
+    def _closePath(self):
+        if self.current and len(self.current) >= 3:
+            self.contours.append(self.current)
+        self.current = None
+
+    _endPath = _closePath
+
+def contours_to_shape(contours):
+    """
+    Fills glyph contours with the nonzero winding rule, so overlapping
+    outlines merge and counters (opposite winding) become holes.
+    """
+    # Signed area of each contour gives its winding direction
+    signs = []
+    polys = []
+    for c in contours:
+        a = np.asarray(c, dtype=np.float64)
+        x, y = a[:, 0], a[:, 1]
+        area = np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y)
+        if area == 0: continue
+        signs.append(1 if area > 0 else -1)
+        polys.append(shapely.make_valid(shapely.Polygon(a)))
+    if not polys:
+        return shapely.Polygon()
+    polys = np.array(polys, dtype=object)
+
+    # Split the plane into faces along every contour, then keep the faces
+    # whose winding number is non-zero
+    edges = shapely.union_all(shapely.boundary(polys))
+    faces = shapely.get_parts(shapely.polygonize(shapely.get_parts(edges)))
+    if len(faces) == 0:
+        return shapely.Polygon()
+    probes = shapely.point_on_surface(faces)
+    winding = np.zeros(len(faces), dtype=np.int64)
+    for poly, sign in zip(polys, signs):
+        winding += sign * shapely.contains(poly, probes)
+    return shapely.union_all(faces[winding != 0])
+
+@lru_cache(maxsize=16)
+def load_font(font_path):
+    font = TTFont(font_path, lazy=True)
+    return font, font.getGlyphSet(), font.getBestCmap(), KerningTable(font)
+
+@lru_cache(maxsize=GLYPH_CACHE_SIZE)
+def glyph_outline(font_path, glyph_name, tolerance):
+    """
+    Flattened outline of one glyph in font units (y up), cached per
+    (font, glyph, tolerance) so repeated letters reuse the geometry.
+    """
+    _, glyph_set, _, _ = load_font(font_path)
+    pen = FlattenPen(glyph_set, tolerance)
+    with font_lock:
+        glyph_set[glyph_name].draw(pen)
+    if not pen.contours:
+        return None
+    return contours_to_shape(pen.contours)
+
+class KerningTable:
+    """
+    Pair kerning from the GPOS 'kern' feature (PairPos formats 1 and 2),
+    falling back to a legacy 'kern' table. As in OpenType layout, every
+    kern lookup is applied and their adjustments add up; within a lookup
+    the first subtable that matches the pair wins.
+    """
+    def __init__(self, font):
+        # One list of (subtable, coverage) per lookup, in lookup order
+        self.lookups = []
+        self.legacy = {}
+        if 'GPOS' in font and font['GPOS'].table.FeatureList:
+            gpos = font['GPOS'].table
+            lookups = set()
+            for fr in gpos.FeatureList.FeatureRecord:
+                if fr.FeatureTag == 'kern':
+                    lookups.update(fr.Feature.LookupListIndex)
+            for index in sorted(lookups):
+                lookup = gpos.LookupList.Lookup[index]
+                subtables = []
+                for st in lookup.SubTable:
+                    if lookup.LookupType == 9:
+                        st = st.ExtSubTable
+                    if getattr(st, 'LookupType', 2) != 2:
+                        continue
+                    coverage = {g: i for i, g in enumerate(st.Coverage.glyphs)}
+                    subtables.append((st, coverage))
+                if subtables:
+                    self.lookups.append(subtables)
+        elif 'kern' in font:
+            for table in font['kern'].kernTables:
+                self.legacy.update(getattr(table, 'kernTable', {}))
+        self.cache = {}
+
+    def get(self, left, right):
+        key = (left, right)
+        if key not in self.cache:
+            with font_lock:
+                self.cache[key] = self.lookup(left, right)
+        return self.cache[key]
+
+    def lookup(self, left, right):
+        if not self.lookups:
+            return self.legacy.get((left, right), 0)
+        return sum(self.lookup_subtables(subtables, left, right) for subtables in self.lookups)
+
+    @staticmethod
+    def lookup_subtables(subtables, left, right):
+        for st, coverage in subtables:
+            index = coverage.get(left)
+            if index is None:
+                continue
+            if st.Format == 1:
+                for record in st.PairSet[index].PairValueRecord:
+                    if record.SecondGlyph == right:
+                        return getattr(record.Value1, 'XAdvance', 0) or 0
+            elif st.Format == 2:
+                class1 = st.ClassDef1.classDefs.get(left, 0)
+                class2 = st.ClassDef2.classDefs.get(right, 0)
+                value = st.Class1Record[class1].Class2Record[class2].Value1
+                return getattr(value, 'XAdvance', 0) or 0
+        return 0
+
+def text_to_shape(text, font_path, tolerance_px=0.5):
+    """
+    Lays out text from TTF glyph outlines (with kerning) and returns a
+    Shapely geometry in px (y up), at the scale create_text_image renders.
+    """
+    font, _, cmap, kerning = load_font(font_path)
+    with font_lock:
+        scale = FONT_SIZE_PX / font['head'].unitsPerEm
+        hmtx = font['hmtx']
+        hhea = font['hhea']
+    tolerance = tolerance_px / scale
+    line_height = hhea.ascent - hhea.descent + LINE_SPACING_PX / scale
+
+    parts = []
+    for line_no, line in enumerate(text.split('\n')):
+        x = 0
+        y = -line_no * line_height
+        prev = None
+        for ch in line:
+            glyph_name = cmap.get(ord(ch), '.notdef')
+            if prev is not None:
+                x += kerning.get(prev, glyph_name)
+            outline = glyph_outline(font_path, glyph_name, tolerance)
+            if outline is not None and not outline.is_empty:
+                parts.append(translate(outline, x, y))
+            x += hmtx[glyph_name][0]
+            prev = glyph_name
+
+    if not parts:
+        raise ValueError("No valid shapes found")
+
+    shape = shapely.union_all(parts)
+    return scale_geometry(shape, scale, scale, origin=(0, 0))
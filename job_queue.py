@@ -0,0 +1,165 @@
+import time
+import uuid
+import queue
+import threading
+from collections import OrderedDict
+
+class QueueFull(Exception):
+    pass
+
+class Job:
+    def __init__(self, key, fn):
+        self.id = str(uuid.uuid4())
+        self.key = key
+        self.fn = fn
+        self.state = 'queued'
+        self.result = None
+        self.error = None
+        self.cancel_requested = False
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.events = []
+        self.changed = threading.Condition()
+
+    def add_event(self, event):
+        """
+        Records a progress event and wakes anyone streaming this job.
+        """
+        with self.changed:
+            self.events.append(dict(event, time=time.time()))
+            self.changed.notify_all()
+
+    def wait_events(self, start, timeout=None):
+        """
+        Returns (events after index start, finished) once there is something
+        new or the timeout passes.
+        """
+        with self.changed:
+            if len(self.events) <= start and self.finished is None:
+                self.changed.wait(timeout)
+            return self.events[start:], self.finished is not None
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.state,
+            'result': self.result,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'last_event': self.events[-1] if self.events else None
+        }
+
+class JobQueue:
+    """
+    In-process job queue with a bounded pool of worker threads.
+    Identical jobs (same key) that are still queued or running are
+    deduplicated; finished jobs are kept for polling up to max_finished.
+    """
+    def __init__(self, workers=2, max_pending=64, max_finished=1024):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        self.active = {}
+        self.threads = []
+
+    def start(self):
+        # Workers start on first submit so importing the app spawns nothing
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self.worker, name=f"job-worker-{i}", daemon=True)
+                t.start()
+                self.threads.append(t)
+
+    def submit(self, key, fn):
+        """
+        Queues fn(job) and returns (job, deduplicated). fn returns the job
+        result or raises; the exception message becomes the job error.
+        """
+        self.start()
+        with self.lock:
+            existing = self.active.get(key)
+            if existing is not None and not existing.cancel_requested:
+                return existing, True
+            pending = sum(1 for j in self.active.values() if j.state == 'queued')
+            if pending >= self.max_pending:
+                raise QueueFull("Too many queued jobs")
+            job = Job(key, fn)
+            self.jobs[job.id] = job
+            self.active[key] = job
+            self.trim()
+        self.queue.put(job)
+        return job, False
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued job outright; a running job can't be interrupted,
+        so it is marked and its result discarded when it finishes.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.state not in ('queued', 'running'):
+                return job
+            job.cancel_requested = True
+            if job.state == 'queued':
+                self.finish(job, 'cancelled')
+            return job
+
+    def finish(self, job, state, result=None, error=None):
+        # Caller holds self.lock
+        with job.changed:
+            job.state = state
+            job.result = result
+            job.error = error
+            job.finished = time.time()
+            job.fn = None
+            job.changed.notify_all()
+        if self.active.get(job.key) is job:
+            del self.active[job.key]
+
+    def trim(self):
+        # Caller holds self.lock; drop the oldest finished jobs
+        finished = [j for j in self.jobs.values() if j.finished is not None]
+        for job in finished[:max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job.id]
+
+    def worker(self):
+        while True:
+            job = self.queue.get()
+            with self.lock:
+                if job.state != 'queued':
+                    continue
+                job.state = 'running'
+                job.started = time.time()
+                fn = job.fn
+            try:
+                result = fn(job)
+                error = None
+            except Exception as e:
+                result = None
+                error = str(e)
+            with self.lock:
+                if job.cancel_requested:
+                    self.finish(job, 'cancelled')
+                elif error is not None:
+                    self.finish(job, 'failed', error=error)
+                else:
+                    self.finish(job, 'done', result=result)
+
+    def stats(self):
+        with self.lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job.state] = counts.get(job.state, 0) + 1
+            return {'workers': self.workers, 'jobs': counts}
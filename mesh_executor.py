@@ -0,0 +1,140 @@
+import os
+import sys
+import zlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+def init_worker():
+    """
+    Runs once in every pool process: pays the heavy imports and font
+    parsing up front so jobs start warm.
+    """
+    import cv2, shapely, stl, mapbox_earcut # noqa: F401
+    import mesh_generator # noqa: F401
+    from font_manager import font_registry
+    from glyph_outline import load_font
+    font_registry.warm(download_missing=False, on_ready=lambda name, path: load_font(path))
+
+class QueueProgress:
+    """
+    Picklable progress callback for worker processes: forwards events to a
+    manager queue that the parent relays to the real callback.
+    """
+    def __init__(self, queue):
+        self.queue = queue
+
+    def __call__(self, event):
+        self.queue.put(event)
+
+def ping():
+    return os.getpid()
+
+class MeshExecutor:
+    """
+    Runs mesh generation in pre-warmed worker processes, so CPU-bound work
+    scales across cores instead of sharing one GIL. Each worker is its own
+    single-process pool: jobs with an affinity key (e.g. the upload or the
+    text + font) always go to the same worker, so a slider tweak finds the
+    earlier stages in that worker's stage caches. Jobs without one are
+    spread round-robin. Workers are replaced after max_jobs_per_worker jobs
+    to cap memory creep, which also empties their caches.
+    With workers=0 everything runs inline in the calling thread.
+    """
+    def __init__(self, workers=None, max_jobs_per_worker=50):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.lock = threading.Lock()
+        self.pools = [None] * max(self.workers, 0)
+        self.next_slot = 0
+        self.manager = None
+
+    def context(self):
+        # max_tasks_per_child needs a non-fork start method
+        method = 'forkserver' if sys.platform.startswith('linux') else 'spawn'
+        return multiprocessing.get_context(method)
+
+    def get_manager(self):
+        with self.lock:
+            if self.manager is None:
+                self.manager = self.context().Manager()
+            return self.manager
+
+    def slot(self, affinity=None):
+        if affinity is not None:
+            return zlib.crc32(repr(affinity).encode('utf-8')) % self.workers
+        with self.lock:
+            slot = self.next_slot
+            self.next_slot = (slot + 1) % self.workers
+            return slot
+
+    def get_pool(self, slot):
+        with self.lock:
+            if self.pools[slot] is None:
+                self.pools[slot] = ProcessPoolExecutor(
+                    max_workers=1,
+                    mp_context=self.context(),
+                    initializer=init_worker,
+                    max_tasks_per_child=self.max_jobs_per_worker
+                )
+            return self.pools[slot]
+
+    def warm(self):
+        """
+        Starts every worker now instead of on the first request.
+        """
+        if self.workers <= 0:
+            return []
+        futures = [self.get_pool(slot).submit(ping) for slot in range(self.workers)]
+        return [f.result() for f in futures]
+
+    def run(self, fn, *args, affinity=None, **kwargs):
+        """
+        Calls fn(*args, **kwargs) in a worker process and waits for the result.
+        fn must be a module-level function so it can be pickled. Calls with
+        equal affinity keys run on the same worker.
+        """
+        if self.workers <= 0:
+            return fn(*args, **kwargs)
+        slot = self.slot(affinity)
+        pool = self.get_pool(slot)
+        progress = kwargs.get('progress')
+        relay = None
+        if progress is not None:
+            # Callbacks can't cross processes; relay events through a queue
+            events = self.get_manager().Queue()
+            kwargs['progress'] = QueueProgress(events)
+            relay = threading.Thread(target=self.relay, args=(events, progress), daemon=True)
+            relay.start()
+        try:
+            return pool.submit(fn, *args, **kwargs).result()
+        except BrokenProcessPool:
+            # The worker died (e.g. OOM); start a fresh one for the next job
+            with self.lock:
+                if self.pools[slot] is pool:
+                    self.pools[slot] = None
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise RuntimeError("Mesh worker crashed")
+        finally:
+            if relay is not None:
+                events.put(None)
+                relay.join()
+
+    @staticmethod
+    def relay(events, progress):
+        while True:
+            event = events.get()
+            if event is None:
+                break
+            progress(event)
+
+    def shutdown(self):
+        with self.lock:
+            pools, self.pools = self.pools, [None] * len(self.pools)
+            manager, self.manager = self.manager, None
+        for pool in pools:
+            if pool is not None:
+                pool.shutdown(wait=True, cancel_futures=True)
+        if manager is not None:
+            manager.shutdown()
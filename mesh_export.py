@@ -0,0 +1,263 @@
+"""
+Mesh export formats.
+
+Binary STL (stl_records / iter_stl / write_stl): each part's triangle
+records are built once and streamed from their own buffers, so the
+combined file is just a header followed by every part's records.
+
+Compact viewer format for generated keychains (.kcm): every part in one
+indexed, quantized binary buffer. All fields are little-endian:
+
+    0   4s   magic b'KCM1'
+    4   u16  version (1)
+    6   u16  flags, bit 0 set = 32-bit indices (else 16-bit)
+    8   u32  vertex count
+    12  u32  index count (3 per triangle)
+    16  u32  part count
+    20  f32  offset x, y, z
+    32  f32  scale x, y, z         position = offset + quantized * scale
+    44  part count x 24 bytes: 8s name (NUL padded), u32 first index,
+        u32 index count, u32 first vertex, u32 vertex count
+    ..  u16  quantized positions, 3 per vertex, padded to 4 bytes
+    ..  u16/u32 indices into the shared vertex array
+
+Positions use the STL's coordinates, quantized over the mesh bounding box.
+
+3MF (write_3mf): one zipped package with each part as an indexed mesh
+object with its own colour, grouped as components of a single object so
+multi-material slicers keep them together. write_3mf_plate puts several
+keychains on one plate, each placed by its build item's transform.
+"""
+import io
+import struct
+import zipfile
+from xml.sax.saxutils import escape
+import numpy as np
+
+# Same record layout as numpy-stl's Mesh.dtype (50 bytes, packed)
+STL_RECORD = np.dtype([('normals', '<f4', (3,)), ('vectors', '<f4', (3, 3)), ('attr', '<u2', (1,))])
+STL_HEADER = b'ai-keychain binary STL'
+STL_CHUNK_RECORDS = 20000 # ~1MB per chunk when streaming to a response
+
+def stl_records(m):
+    """
+    Binary STL records of an IndexedMesh. Normals are the unnormalized
+    face cross products, computed in float32 as numpy-stl does.
+    """
+    records = np.zeros(len(m.faces), dtype=STL_RECORD)
+    records['vectors'] = m.vertices[m.faces]
+    v = records['vectors']
+    records['normals'] = np.cross(v[:, 1] - v[:, 0], v[:, 2] - v[:, 0])
+    return records
+
+def stl_size(records_list):
+    return 84 + STL_RECORD.itemsize * sum(len(r) for r in records_list)
+
+def iter_stl(records_list, chunk_records=None):
+    """
+    Yields a binary STL made of several parts' records as memoryviews over
+    the record buffers: header and triangle count first, then each part in
+    order, split into chunk_records-sized pieces if given. Nothing is
+    concatenated or copied.
+    """
+    count = sum(len(r) for r in records_list)
+    yield memoryview(STL_HEADER.ljust(80, b' ') + struct.pack('<I', count))
+    for records in records_list:
+        raw = memoryview(np.ascontiguousarray(records).view(np.uint8))
+        step = (chunk_records or max(len(records), 1)) * STL_RECORD.itemsize
+        for start in range(0, len(raw), step):
+            yield raw[start:start + step]
+
+def write_stl(file, records_list):
+    """
+    Streams records_list to a path or a writable binary file object.
+    """
+    if isinstance(file, str):
+        with open(file, 'wb') as f:
+            return write_stl(f, records_list)
+    for chunk in iter_stl(records_list):
+        file.write(chunk)
+
+MAGIC = b'KCM1'
+VERSION = 1
+FLAG_INDEX_32 = 1
+HEADER = struct.Struct('<4sHHIII3f3f')
+PART = struct.Struct('<8sIIII')
+
+def encode_viewer_mesh(parts):
+    """
+    Encodes [(name, IndexedMesh), ...] as one .kcm buffer.
+    """
+    parts = [(name, m) for name, m in parts if len(m.faces)]
+    vertices = np.vstack([m.vertices for _, m in parts]) if parts else np.zeros((0, 3))
+    lo = vertices.min(axis=0) if len(vertices) else np.zeros(3)
+    extent = (vertices.max(axis=0) - lo) if len(vertices) else np.zeros(3)
+    scale = extent / 65535.0
+    quantized = np.zeros_like(vertices, dtype=np.uint16)
+    if len(vertices):
+        safe = np.where(scale > 0, scale, 1.0)
+        quantized = np.rint((vertices - lo) / safe).astype(np.uint16)
+
+    wide = len(vertices) > 0xFFFF
+    index_type = '<u4' if wide else '<u2'
+    indices = []
+    table = []
+    v_offset = 0
+    i_offset = 0
+    for name, m in parts:
+        idx = (m.faces + v_offset).astype(index_type).ravel()
+        table.append(PART.pack(name.encode('ascii')[:8], i_offset, len(idx), v_offset, len(m.vertices)))
+        indices.append(idx)
+        v_offset += len(m.vertices)
+        i_offset += len(idx)
+    indices = np.concatenate(indices) if indices else np.zeros(0, index_type)
+
+    flags = FLAG_INDEX_32 if wide else 0
+    header = HEADER.pack(MAGIC, VERSION, flags, len(vertices), len(indices), len(parts), *lo, *scale)
+    positions = quantized.astype('<u2').tobytes()
+    # Keep the index array 4-byte aligned for Uint32Array views
+    padding = b'\0' * (-len(positions) % 4)
+    return b''.join([header] + table + [positions, padding, indices.tobytes()])
+
+def decode_viewer_mesh(data):
+    """
+    Inverse of encode_viewer_mesh: returns [(name, vertices, faces), ...]
+    with dequantized float32 vertices and faces local to each part.
+    """
+    magic, version, flags, n_verts, n_idx, n_parts, *rest = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a KCM1 mesh")
+    lo = np.array(rest[:3], np.float32)
+    scale = np.array(rest[3:], np.float32)
+    pos = HEADER.size + n_parts * PART.size
+    table = [PART.unpack_from(data, HEADER.size + i * PART.size) for i in range(n_parts)]
+    q = np.frombuffer(data, '<u2', n_verts * 3, pos).reshape(-1, 3)
+    pos += n_verts * 6 + (-n_verts * 6 % 4)
+    indices = np.frombuffer(data, '<u4' if flags & FLAG_INDEX_32 else '<u2', n_idx, pos)
+    vertices = lo + q * scale
+    out = []
+    for name, first_i, count_i, first_v, count_v in table:
+        faces = indices[first_i:first_i + count_i].reshape(-1, 3).astype(np.int64) - first_v
+        out.append((name.rstrip(b'\0').decode('ascii'), vertices[first_v:first_v + count_v], faces))
+    return out
+
+CONTENT_TYPES_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+ <Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+ <Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>
+</Types>
+"""
+
+RELS_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+ <Relationship Target="/3D/3dmodel.model" Id="rel0" Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>
+</Relationships>
+"""
+
+DEFAULT_COLORS = {'base': '#1E293B', 'text': '#FFD700'}
+XML_ATTR = {'"': '&quot;'}
+
+def normalize_color(color, default):
+    # 3MF wants #RRGGBB or #RRGGBBAA
+    if isinstance(color, str):
+        value = color.strip().lstrip('#')
+        if len(value) in (6, 8) and all(c in '0123456789abcdefABCDEF' for c in value):
+            return '#' + value.upper()
+    return default
+
+def mesh_xml(m):
+    """
+    <mesh> element of an indexed mesh, formatted in bulk with savetxt.
+    """
+    buf = io.BytesIO()
+    buf.write(b'  <mesh>\n   <vertices>\n')
+    np.savetxt(buf, m.vertices, fmt='    <vertex x="%.4f" y="%.4f" z="%.4f"/>')
+    buf.write(b'   </vertices>\n   <triangles>\n')
+    np.savetxt(buf, m.faces, fmt='    <triangle v1="%d" v2="%d" v3="%d"/>')
+    buf.write(b'   </triangles>\n  </mesh>\n')
+    return buf.getvalue()
+
+def write_3mf(path, parts, colors=None, compresslevel=6):
+    """
+    Writes [(name, IndexedMesh), ...] as a 3MF package. colors maps part
+    name to a hex colour (e.g. the AI's base_color / text_color).
+    """
+    return write_3mf_plate(path, [('keychain', parts)], colors, compresslevel=compresslevel)
+
+def plate_layout(keychains, gap):
+    """
+    Grid placement for [(name, parts), ...]: one (x, y) offset per
+    keychain so their bounding boxes sit gap apart, first one at the origin.
+    """
+    boxes = []
+    for _, parts in keychains:
+        vertices = np.vstack([m.vertices for _, m in parts if len(m.vertices)] or [np.zeros((1, 3))])
+        boxes.append((vertices[:, :2].min(axis=0), vertices[:, :2].max(axis=0)))
+    if not boxes:
+        return []
+    cell = np.max([hi - lo for lo, hi in boxes], axis=0) + gap
+    columns = int(np.ceil(np.sqrt(len(boxes))))
+    offsets = []
+    for i, (lo, _) in enumerate(boxes):
+        row, col = divmod(i, columns)
+        # Rows go down the plate, like the text lines they came from
+        offsets.append((col * cell[0] - lo[0], -row * cell[1] - lo[1]))
+    return offsets
+
+def write_3mf_plate(path, keychains, colors=None, offsets=None, compresslevel=6):
+    """
+    Writes several keychains, [(name, [(part name, IndexedMesh), ...]), ...],
+    as one 3MF plate: each keychain is an object of its parts, placed by
+    its (x, y) from offsets through the build item transform. Parts share
+    one material per part name. path may be a file object.
+    """
+    colors = colors or {}
+    keychains = [(name, [(p, m) for p, m in parts if len(m.faces)]) for name, parts in keychains]
+    materials = []
+    for _, parts in keychains:
+        for part_name, _ in parts:
+            if part_name not in materials:
+                materials.append(part_name)
+    model = io.BytesIO()
+    model.write(b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                b'<model unit="millimeter" xml:lang="en-US" '
+                b'xmlns="http://schemas.microsoft.com/3dmanufacturing/core/2015/02">\n'
+                b' <resources>\n  <basematerials id="1">\n')
+    for part_name in materials:
+        color = normalize_color(colors.get(part_name), DEFAULT_COLORS.get(part_name, '#FFFFFF'))
+        model.write(f'   <base name="{part_name}" displaycolor="{color}"/>\n'.encode())
+    model.write(b'  </basematerials>\n')
+    # Object ids start after the material group: every part, then the groups
+    object_id = 2
+    members = []
+    for _, parts in keychains:
+        ids = []
+        for part_name, m in parts:
+            model.write(f' <object id="{object_id}" name="{part_name}" type="model" pid="1" '
+                        f'pindex="{materials.index(part_name)}">\n'.encode())
+            model.write(mesh_xml(m))
+            model.write(b' </object>\n')
+            ids.append(object_id)
+            object_id += 1
+        members.append(ids)
+    items = []
+    for i, ((name, _), ids) in enumerate(zip(keychains, members)):
+        model.write(f' <object id="{object_id}" name="{escape(name, XML_ATTR)}" type="model">\n  <components>\n'.encode())
+        for part_id in ids:
+            model.write(f'   <component objectid="{part_id}"/>\n'.encode())
+        model.write(b'  </components>\n </object>\n')
+        transform = ''
+        if offsets is not None:
+            x, y = offsets[i]
+            transform = f' transform="1 0 0 0 1 0 0 0 1 {x:.4f} {y:.4f} 0"'
+        items.append(f'  <item objectid="{object_id}"{transform}/>\n')
+        object_id += 1
+    model.write(b' </resources>\n <build>\n')
+    model.write(''.join(items).encode())
+    model.write(b' </build>\n</model>\n')
+
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zf:
+        zf.writestr('[Content_Types].xml', CONTENT_TYPES_XML)
+        zf.writestr('_rels/.rels', RELS_XML)
+        zf.writestr('3D/3dmodel.model', model.getvalue())
+    return path
@@ -1,3 +1,6 @@
+import os
+import time
+from functools import lru_cache
 import cv2
 import numpy as np
 from stl import mesh
@@ -5,22 +8,243 @@ import mapbox_earcut as earcut
 from shapely.geometry import Polygon, MultiPolygon, Point
 from shapely.ops import unary_union
 from shapely.affinity import translate
+import shapely
+from glyph_outline import text_to_shape
+from font_manager import get_font_path
+from mesh_export import encode_viewer_mesh, write_3mf, stl_records, write_stl
+
+PX_PER_MM = 11.8 # Approx 300 DPI
+# Entries kept per pipeline stage (see process_image_to_mesh)
+STAGE_CACHE_SIZE = 16
+
+# Contour simplification tolerance in mm (well below FDM nozzle resolution)
+CONTOUR_TOLERANCE_MM = 0.05
+# Contours smaller than this (in px^2) are scan noise
+MIN_CONTOUR_AREA_PX = 10
+# Uploads are stored as a 1-bit foreground mask (see upload_pipeline.py)
+MASK_SUFFIX = '.mask.png'
+
+# Detail levels. contour_tolerance in mm (None = CONTOUR_TOLERANCE_MM),
+# quad_segs = arc segments per quarter circle in buffers (shapely's default
+# is 16), vertex_budget caps the text outline's vertex count
+QUALITY_PRESETS = {
+    'final': {'contour_tolerance': None, 'quad_segs': 16, 'vertex_budget': None},
+    'preview': {'contour_tolerance': 0.25, 'quad_segs': 3, 'vertex_budget': 1500},
+}
 
 def process_image_to_mesh(image_path, output_path, text=None, shape_type='cutout', 
                           text_thickness=3.0, base_thickness=2.0, base_padding=5.0, text_dilation=0.0,
                           outline_type='bubble', hole_radius=3.0, hole_position='top', 
-                          hole_x_off=0, hole_y_off=0):
+                          hole_x_off=0, hole_y_off=0, wall_engine=None,
+                          contour_tolerance=None, quality='final', colors=None, progress=None):
     """
     Converts an image to a 3D STL mesh with advanced layering.
+    quality='preview' trades detail for speed (see QUALITY_PRESETS).
+    An output_path ending in .3mf writes one multi-material 3MF instead of
+    STLs, with colors ({'base': '#rrggbb', 'text': ...}) as its materials.
+    With output_path=None nothing is written and the [(name, IndexedMesh)]
+    parts are returned for the caller to stream.
+    """
+    if contour_tolerance is None:
+        contour_tolerance = quality_preset(quality)['contour_tolerance']
+    text_key = ('image', image_source_key(image_path), contour_tolerance)
+    return outline_to_mesh(text_key, output_path, text_thickness, base_thickness, base_padding,
+                           text_dilation, outline_type, hole_radius, hole_position,
+                           hole_x_off, hole_y_off, wall_engine, quality, colors, progress)
+
+def process_text_to_mesh(text, output_path, font_name='sans', shape_type='cutout',
+                         text_thickness=3.0, base_thickness=2.0, base_padding=5.0, text_dilation=0.0,
+                         outline_type='bubble', hole_radius=3.0, hole_position='top',
+                         hole_x_off=0, hole_y_off=0, wall_engine=None,
+                         contour_tolerance=None, quality='final', colors=None, progress=None, font_path=None):
+    """
+    Converts text to a 3D STL mesh straight from the font's glyph outlines,
+    without rendering and tracing an image. Output options as for
+    process_image_to_mesh. Callers that resolved font_path themselves (e.g.
+    for a cache key) pass it so a worker process can't pick another font.
+    """
+    font_path = font_path or get_font_path(font_name)
+    if font_path is None:
+        raise ValueError(f"Font not available: {font_name}")
+    if contour_tolerance is None:
+        contour_tolerance = quality_preset(quality)['contour_tolerance']
+    text_key = ('glyphs', text, font_path, contour_tolerance)
+    return outline_to_mesh(text_key, output_path, text_thickness, base_thickness, base_padding,
+                           text_dilation, outline_type, hole_radius, hole_position,
+                           hole_x_off, hole_y_off, wall_engine, quality, colors, progress)
+
+def quality_preset(quality):
+    if quality not in QUALITY_PRESETS:
+        raise ValueError(f"Unknown quality: {quality}")
+    return QUALITY_PRESETS[quality]
+
+def outline_to_mesh(text_key, output_path, text_thickness, base_thickness, base_padding,
+                    text_dilation, outline_type, hole_radius, hole_position,
+                    hole_x_off, hole_y_off, wall_engine, quality='final', colors=None, progress=None):
+    """
+    Builds and saves the keychain meshes for a text outline source.
+    Runs as memoized stages (mask/glyphs -> text outline -> dilated outline ->
+    base outline -> hole-cut base -> triangulation -> extrusion), each keyed
+    on the inputs it depends on, so late-stage tweaks skip earlier work.
+    progress, if given, is called with an event dict as each stage finishes.
+    """
+    report = StageReporter(progress)
+    preset = quality_preset(quality)
+    quad_segs = preset['quad_segs']
+    
+    # Stage keys: each extends its parent's key with its own parameters
+    dilated_key = (text_key, float(text_dilation), quad_segs, preset['vertex_budget'])
+    base_key = (dilated_key, outline_type, float(base_padding), quad_segs)
+    hole_key = (base_key, hole_position, float(hole_radius), float(hole_x_off), float(hole_y_off), quad_segs)
+
+    # Stages are called in order so progress is reported per stage;
+    # later calls hit the cache for the stages they depend on
+    if text_key[0] == 'image':
+        gray = image_stage(text_key[1])
+        report('image_load', width=gray.shape[1], height=gray.shape[0])
+        mask_stage(text_key[1])
+        report('threshold')
+    report('contours', vertices=count_vertices(text_outline(text_key)))
+    
+    dilated_outline_stage(*dilated_key)
+    base_outline = base_outline_stage(*base_key)
+    report('union_buffer', vertices=count_vertices(base_outline))
+    
+    base_shape = hole_cut_stage(*hole_key)
+    report('hole_cut', vertices=count_vertices(base_shape))
+    
+    triangulations = [triangulate_text_stage(dilated_key)]
+    if base_shape:
+        triangulations.append(triangulate_base_stage(hole_key))
+    report('triangulation', vertices=sum(len(t[0]) for t in triangulations),
+           triangles=sum(len(t[1]) for t in triangulations))
+
+    # Extrude Meshes
+    meshes = []
+
+    # 1. Base Mesh
+    if base_shape:
+        b_verts, b_faces, b_rings = triangulate_base_stage(hole_key)
+        # Base goes from z=0 to z=base_thickness
+        # Walls come straight from the rings unless an edge engine is requested
+        base_mesh = extrude_faces_indexed(b_verts, b_faces, base_thickness, wall_engine=wall_engine,
+                                          rings=b_rings if wall_engine is None else None)
+        meshes.append(base_mesh)
+
+    # 2. Text Mesh
+    # Text sits ON TOP of base? Or goes through?
+    # Usually on top. z = base_thickness to z = base_thickness + text_thickness
+    t_verts, t_faces, t_rings = triangulate_text_stage(dilated_key)
+    
+    # We need a custom extrude that supports Z-offset
+    # Or just extrude normally and translate the mesh in Z
+    text_mesh = extrude_faces_indexed(t_verts, t_faces, text_thickness, wall_engine=wall_engine,
+                                      rings=t_rings if wall_engine is None else None)
+    text_mesh.translate([0, 0, base_thickness]) # Move up
+    meshes.append(text_mesh)
+    report('extrusion', vertices=sum(len(m.vertices) for m in meshes),
+           triangles=sum(len(m.faces) for m in meshes))
+
+    named_parts = [('base', meshes[0])] if base_shape else []
+    named_parts.append(('text', meshes[-1]))
+    
+    if output_path is None:
+        report('save', triangles=sum(len(m.faces) for m in meshes))
+        return named_parts
+    
+    if output_path.endswith('.3mf'):
+        # Both parts in one package; nothing is written twice
+        write_3mf(output_path, named_parts, colors)
+        triangles = sum(len(m.faces) for m in meshes)
+    else:
+        # Each part's STL records are built once; the combined file streams
+        # the same buffers after its own header instead of concatenating
+        records = [(name, stl_records(m)) for name, m in named_parts]
+        write_stl(output_path, [r for _, r in records])
+        triangles = sum(len(r) for _, r in records)
+        
+        # Save separate parts for viewer
+        for name, part_records in records:
+            write_stl(output_path.replace('.stl', f'_{name}.stl'), [part_records])
+    
+    # Indexed, quantized copy of the parts for the web viewer
+    with open(viewer_mesh_path(output_path), 'wb') as f:
+        f.write(encode_viewer_mesh(named_parts))
+    
+    report('save', triangles=triangles)
+            
+    return output_path
+
+def viewer_mesh_path(output_path):
+    return os.path.splitext(output_path)[0] + '.kcm'
+
+class StageReporter:
+    """
+    Sends stage-finished events (stage, elapsed and stage duration in
+    seconds, plus counts) to a progress callback; a no-op without one.
+    """
+    def __init__(self, progress):
+        self.progress = progress
+        self.start = self.last = time.perf_counter()
+
+    def __call__(self, stage, **counts):
+        if self.progress is None:
+            return
+        now = time.perf_counter()
+        event = {'stage': stage, 'elapsed': round(now - self.start, 4),
+                 'duration': round(now - self.last, 4)}
+        event.update(counts)
+        self.last = now
+        self.progress(event)
+
+def count_vertices(shape):
+    return 0 if shape is None else int(shapely.get_num_coordinates(shape))
+
+def image_source_key(image_path):
+    """
+    Identifies an input image by path, modification time and size.
+    """
+    try:
+        st = os.stat(image_path)
+    except OSError:
+        raise ValueError("Could not load image")
+    return (os.path.abspath(image_path), st.st_mtime_ns, st.st_size)
+
+@lru_cache(maxsize=4)
+def image_stage(image_key):
+    """
+    Stage 1a: the image decoded to grayscale.
     """
+    if is_mask_path(image_key[0]):
+        # Normalized upload, already a 1-bit mask
+        img = cv2.imread(image_key[0], cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            raise ValueError("Could not load mask")
+        return img
+    
     # 1. Load and preprocess image
-    img = cv2.imread(image_path)
+    img = cv2.imread(image_key[0])
     if img is None:
         raise ValueError("Could not load image")
     
     # Convert to grayscale
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+@lru_cache(maxsize=STAGE_CACHE_SIZE)
+def mask_stage(image_key):
+    """
+    Stage 1b: binary foreground mask of the image.
+    """
+    gray = image_stage(image_key)
+    if is_mask_path(image_key[0]):
+        return gray
+    return binarize(gray)
+
+def binarize(gray):
+    """
+    Foreground mask (255 = text) of a grayscale image: dark content on a
+    light background, as traced by the contour stage.
+    """
     # Threshold
     _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
     
@@ -28,80 +252,89 @@ def process_image_to_mesh(image_path, output_path, text=None, shape_type='cutout
     kernel = np.ones((3,3), np.uint8)
     thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
     
-    # Find contours for TEXT/FOREGROUND
-    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    if not contours:
-        raise ValueError("No shape found in image")
-        
-    # Process contours into Shapely polygons
-    text_polygons = []
-    for c in contours:
-        # Lower threshold to catch small punctuation/dots
-        if cv2.contourArea(c) < 10: continue 
-        
-        epsilon = 0.002 * cv2.arcLength(c, True)
-        approx = cv2.approxPolyDP(c, epsilon, True)
-        if len(approx) < 3: continue
-        
-        points = approx.reshape(-1, 2)
-        points[:, 1] = -points[:, 1] # Flip Y
-        poly = Polygon(points)
-        if not poly.is_valid: poly = poly.buffer(0)
-        text_polygons.append(poly)
+    return thresh
+
+def is_mask_path(path):
+    return path.endswith(MASK_SUFFIX)
+
+@lru_cache(maxsize=STAGE_CACHE_SIZE)
+def text_outline_stage(image_key, contour_tolerance):
+    """
+    Stage 2: simplified, centered text outline traced from the mask.
+    """
+    thresh = mask_stage(image_key)
     
-    if not text_polygons:
-        raise ValueError("No valid shapes found")
-        
-    text_shape = unary_union(text_polygons)
+    # Contours -> simplified text outline (single pass)
+    text_shape, contour_stats = extract_text_shape(thresh, PX_PER_MM, contour_tolerance)
+    print(f"Contours: {contour_stats['contours']} rings, "
+          f"{contour_stats['vertices_raw']} -> {contour_stats['vertices_simplified']} vertices")
     
     # Center the shape
     minx, miny, maxx, maxy = text_shape.bounds
     center_x = (minx + maxx) / 2
     center_y = (miny + maxy) / 2
-    
-    if isinstance(text_shape, MultiPolygon):
-        translated_parts = [translate_polygon(p, -center_x, -center_y) for p in text_shape.geoms]
-        text_shape = MultiPolygon(translated_parts)
-    else:
-        text_shape = translate_polygon(text_shape, -center_x, -center_y)
-    
-    # ... (Contour processing) ...
-    
-    # 3. Find contours
-    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    # Create Polygon from contours
-    polys = []
-    for cnt in contours:
-        if len(cnt) < 3: continue
-        # Flip Y axis to match 3D coordinates (Image Y is down, 3D Y is up)
-        # Also scale down slightly to reasonable units if needed, but mainly flip Y
-        points = cnt.reshape(-1, 2)
-        points[:, 1] = -points[:, 1] # Flip Y
-        
-        poly = Polygon(points)
-        if not poly.is_valid:
-            poly = poly.buffer(0)
-        polys.append(poly)
-        
-    if not polys:
-        raise ValueError("No valid shapes found")
-        
-    text_shape = unary_union(polys)
+    return translate(text_shape, -center_x, -center_y)
+
+@lru_cache(maxsize=STAGE_CACHE_SIZE)
+def glyph_outline_stage(text, font_path, contour_tolerance):
+    """
+    Stage 2 (text input): centered text outline built from glyph outlines.
+    """
+    if contour_tolerance is None:
+        contour_tolerance = CONTOUR_TOLERANCE_MM
+    text_shape = text_to_shape(text, font_path, contour_tolerance * PX_PER_MM)
+    print(f"Glyphs: {len(text)} chars, {shapely.get_num_coordinates(text_shape)} vertices")
     
     # Center the shape
     minx, miny, maxx, maxy = text_shape.bounds
     center_x = (minx + maxx) / 2
     center_y = (miny + maxy) / 2
-    text_shape = translate(text_shape, -center_x, -center_y)
+    return translate(text_shape, -center_x, -center_y)
+
+def text_outline(text_key):
+    """
+    Resolves a text key to its outline: ('image', image_key, tolerance)
+    or ('glyphs', text, font_path, tolerance).
+    """
+    if text_key[0] == 'glyphs':
+        return glyph_outline_stage(*text_key[1:])
+    return text_outline_stage(*text_key[1:])
+
+@lru_cache(maxsize=STAGE_CACHE_SIZE)
+def dilated_outline_stage(text_key, text_dilation, quad_segs=16, vertex_budget=None):
+    """
+    Stage 3: text outline widened by text_dilation (mm).
+    """
+    text_shape = text_outline(text_key)
+    if vertex_budget:
+        text_shape = fit_vertex_budget(text_shape, vertex_budget)
     
     # Apply Text Dilation (Width/Boldness)
-    px_per_mm = 11.8 # Approx 300 DPI
-    
     if text_dilation > 0:
         # Dilation with round join/cap for smoothness
-        text_shape = text_shape.buffer(text_dilation * px_per_mm, join_style=1, cap_style=1)
+        text_shape = text_shape.buffer(text_dilation * PX_PER_MM, quad_segs=quad_segs, join_style=1, cap_style=1)
+    
+    return text_shape
+
+def fit_vertex_budget(shape, budget):
+    """
+    Simplifies shape with a doubling tolerance (from 0.5px) until it has at
+    most budget vertices, or the tolerance reaches 1mm.
+    """
+    tolerance = 0.5
+    simplified = shape
+    while count_vertices(simplified) > budget and tolerance <= PX_PER_MM:
+        simplified = shapely.simplify(shape, tolerance, preserve_topology=True)
+        tolerance *= 2
+    return simplified
+
+@lru_cache(maxsize=STAGE_CACHE_SIZE)
+def base_outline_stage(dilated_key, outline_type, base_padding, quad_segs=16):
+    """
+    Stage 4: base plate outline around the text, or None for no base.
+    """
+    text_shape = dilated_outline_stage(*dilated_key)
+    px_per_mm = PX_PER_MM
     
     # Generate Base Shape
     base_shape = None
@@ -115,7 +348,7 @@ def process_image_to_mesh(image_path, output_path, text=None, shape_type='cutout
         padding_px = base_padding * px_per_mm
         
         # Large buffer to merge everything
-        merged_shape = text_shape.buffer(padding_px, join_style=1, cap_style=1)
+        merged_shape = text_shape.buffer(padding_px, quad_segs=quad_segs, join_style=1, cap_style=1)
         
         # Optional: Negative buffer to tighten up deep crevices if needed, 
         # but for "bubble" we usually want it filled. 
@@ -137,7 +370,7 @@ def process_image_to_mesh(image_path, output_path, text=None, shape_type='cutout
             (minx - padding_px, maxy + padding_px)
         ])
         # Round the corners of the rect slightly
-        base_shape = box.buffer(padding_px * 0.2, join_style=1)
+        base_shape = box.buffer(padding_px * 0.2, quad_segs=quad_segs, join_style=1)
         
     else: # None or cutout
         # For cutout, base is same as text but we might want a backing?
@@ -146,6 +379,16 @@ def process_image_to_mesh(image_path, output_path, text=None, shape_type='cutout
         # Let's assume 'none' means just the text mesh (no base).
         base_shape = None
 
+    return base_shape
+
+@lru_cache(maxsize=STAGE_CACHE_SIZE)
+def hole_cut_stage(base_key, hole_position, hole_radius, hole_x_off, hole_y_off, quad_segs=16):
+    """
+    Stage 5: base outline with the keyring tab added and the hole cut out.
+    """
+    base_shape = base_outline_stage(*base_key)
+    px_per_mm = PX_PER_MM
+    
     # Add Keyring Hole
     if base_shape and hole_position != 'none':
         hole_r_px = hole_radius * px_per_mm
@@ -176,70 +419,127 @@ def process_image_to_mesh(image_path, output_path, text=None, shape_type='cutout
             hx = float(hole_x_off) * px_per_mm
             hy = float(hole_y_off) * px_per_mm
             
-        # Create the tab for the hole
-        # A circle at hx, hy with radius = hole_margin
-        hole_tab = Point(hx, hy).buffer(hole_margin, join_style=1, cap_style=1)
+        # Tab (radius = hole_margin) and cutout circles, shared across requests
+        hole_tab, hole_cutout = hole_circles(hole_radius, quad_segs)
+        
+        # Create the tab for the hole at hx, hy
+        hole_tab = translate(hole_tab, hx, hy)
         
         # Merge tab with base
         base_shape = unary_union([base_shape, hole_tab])
         
         # Create the actual hole cutout
-        hole_cutout = Point(hx, hy).buffer(hole_r_px, join_style=1, cap_style=1)
+        hole_cutout = translate(hole_cutout, hx, hy)
         
         # Subtract hole from base
         base_shape = base_shape.difference(hole_cutout)
 
-    # Extrude Meshes
-    meshes = []
+    return base_shape
 
-    # 1. Base Mesh
-    if base_shape:
-        b_verts, b_faces = triangulate_polygon(base_shape)
-        # Base goes from z=0 to z=base_thickness
-        base_mesh = extrude_faces(b_verts, b_faces, base_thickness)
-        meshes.append(base_mesh)
+@lru_cache(maxsize=STAGE_CACHE_SIZE)
+def hole_circles(hole_radius, quad_segs=16):
+    """
+    Keyring tab and hole cutout circles centered at the origin.
+    """
+    hole_r_px = hole_radius * PX_PER_MM
+    hole_margin = hole_r_px * 2.5 # Enough plastic around hole
+    hole_tab = Point(0, 0).buffer(hole_margin, quad_segs=quad_segs, join_style=1, cap_style=1)
+    hole_cutout = Point(0, 0).buffer(hole_r_px, quad_segs=quad_segs, join_style=1, cap_style=1)
+    return hole_tab, hole_cutout
 
-    # 2. Text Mesh
-    # Text sits ON TOP of base? Or goes through?
-    # Usually on top. z = base_thickness to z = base_thickness + text_thickness
-    t_verts, t_faces = triangulate_polygon(text_shape)
-    
-    # We need a custom extrude that supports Z-offset
-    # Or just extrude normally and translate the mesh in Z
-    text_mesh = extrude_faces(t_verts, t_faces, text_thickness)
-    text_mesh.translate([0, 0, base_thickness]) # Move up
-    meshes.append(text_mesh)
+@lru_cache(maxsize=STAGE_CACHE_SIZE)
+def triangulate_text_stage(dilated_key):
+    """
+    Stage 6a: triangulation (vertices, faces, rings) of the text outline.
+    """
+    return freeze_triangulation(triangulate_polygon(dilated_outline_stage(*dilated_key), return_rings=True))
+
+@lru_cache(maxsize=STAGE_CACHE_SIZE)
+def triangulate_base_stage(hole_key):
+    """
+    Stage 6b: triangulation (vertices, faces, rings) of the hole-cut base.
+    """
+    return freeze_triangulation(triangulate_polygon(hole_cut_stage(*hole_key), return_rings=True))
+
+def freeze_triangulation(triangulation):
+    # Cached arrays are shared between requests, so make them read-only
+    vertices, faces, rings = triangulation
+    vertices.setflags(write=False)
+    faces.setflags(write=False)
+    return vertices, faces, tuple(rings)
+
+PIPELINE_STAGES = [
+    image_stage, mask_stage, text_outline_stage, glyph_outline_stage, dilated_outline_stage,
+    base_outline_stage, hole_cut_stage, hole_circles, triangulate_text_stage,
+    triangulate_base_stage,
+]
 
-    # Combine meshes
-    combined_mesh = mesh.Mesh(np.concatenate([m.data for m in meshes]))
-    combined_mesh.save(output_path)
+def stage_cache_info():
+    return {stage.__name__: stage.cache_info()._asdict() for stage in PIPELINE_STAGES}
+
+def clear_stage_caches():
+    for stage in PIPELINE_STAGES:
+        stage.cache_clear()
+
+def extract_text_shape(thresh, px_per_mm, tolerance_mm=None):
+    """
+    Traces the foreground of a binary mask once and returns (shape, stats).
+    Contours are simplified with approxPolyDP at tolerance_mm (converted to
+    pixels) and turned into polygons in bulk. Y is flipped to 3D orientation.
+    """
+    if tolerance_mm is None:
+        tolerance_mm = CONTOUR_TOLERANCE_MM
+    epsilon = tolerance_mm * px_per_mm
+    
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     
-    # Save separate parts for viewer
-    base_path = output_path.replace('.stl', '_base.stl')
-    text_path = output_path.replace('.stl', '_text.stl')
+    if not contours:
+        raise ValueError("No shape found in image")
     
-    if len(meshes) > 0:
-        # Base is usually index 0 if it exists
-        # But if outline_type is none, we might only have text?
-        # Let's be safe.
-        if base_shape:
-            meshes[0].save(base_path)
+    rings = []
+    vertices_raw = 0
+    for c in contours:
+        vertices_raw += len(c)
+        # Lower threshold to catch small punctuation/dots
+        if cv2.contourArea(c) < MIN_CONTOUR_AREA_PX: continue
         
-        if len(meshes) > 1:
-            meshes[1].save(text_path)
-        elif not base_shape:
-            # Only text
-            meshes[0].save(text_path)
-            
-    return output_path
+        if epsilon > 0:
+            c = cv2.approxPolyDP(c, epsilon, True)
+        if len(c) < 3: continue
+        rings.append(c.reshape(-1, 2))
+    
+    if not rings:
+        raise ValueError("No valid shapes found")
+    
+    # Build all polygons at once from a flat coordinate array
+    coords = np.concatenate(rings).astype(np.float64)
+    coords[:, 1] = -coords[:, 1] # Flip Y
+    indices = np.repeat(np.arange(len(rings)), [len(r) for r in rings])
+    polys = shapely.polygons(shapely.linearrings(coords, indices=indices))
+    
+    invalid = ~shapely.is_valid(polys)
+    if invalid.any():
+        polys[invalid] = shapely.buffer(polys[invalid], 0)
+    
+    text_shape = shapely.union_all(polys)
+    if text_shape.is_empty:
+        raise ValueError("No valid shapes found")
+    
+    stats = {
+        'contours': len(rings),
+        'vertices_raw': vertices_raw,
+        'vertices_simplified': len(coords),
+    }
+    return text_shape, stats
 
 def translate_polygon(poly, dx, dy):
     return Polygon([(x + dx, y + dy) for x, y in poly.exterior.coords])
 
-def triangulate_polygon(polygon):
+def triangulate_polygon(polygon, return_rings=False):
     """
     Triangulates a Shapely polygon (with holes) using mapbox_earcut.
-    Returns (vertices, faces).
+    Returns (vertices, faces), plus the ring layout when return_rings is set:
+    a list of (start, end, is_hole) vertex ranges, one per ring.
     """
     # Prepare data for earcut
     # Earcut expects a flat array of coordinates and an array of hole indices
@@ -248,17 +548,21 @@ def triangulate_polygon(polygon):
         # Handle multipolygon by processing each part and merging
         all_vertices = []
         all_faces = []
+        all_rings = []
         v_offset = 0
         for p in polygon.geoms:
-            v, f = triangulate_single_polygon(p)
+            v, f, r = triangulate_single_polygon(p, return_rings=True)
             all_vertices.extend(v)
             all_faces.extend([face + v_offset for face in f])
+            all_rings.extend([(s + v_offset, e + v_offset, h) for s, e, h in r])
             v_offset += len(v)
+        if return_rings:
+            return np.array(all_vertices), np.array(all_faces), all_rings
         return np.array(all_vertices), np.array(all_faces)
     else:
-        return triangulate_single_polygon(polygon)
+        return triangulate_single_polygon(polygon, return_rings=return_rings)
 
-def triangulate_single_polygon(polygon):
+def triangulate_single_polygon(polygon, return_rings=False):
     exterior = list(polygon.exterior.coords)[:-1] # remove duplicate last point
     holes = [list(h.coords)[:-1] for h in polygon.interiors]
     
@@ -284,12 +588,53 @@ def triangulate_single_polygon(polygon):
     # Reshape triangles to (N, 3)
     faces = triangles.reshape(-1, 3)
     
+    if return_rings:
+        # First ring is the exterior, the rest are holes
+        rings_starts = [0] + rings_ends[:-1]
+        rings = [(s, e, i > 0) for i, (s, e) in enumerate(zip(rings_starts, rings_ends))]
+        return np.array(vertices), faces, rings
+    
     return np.array(vertices), faces
 
-def extrude_faces(vertices, faces, height):
+class IndexedMesh:
     """
-    Extrudes 2D faces into a 3D mesh.
+    Shared-vertex triangle mesh: vertices (N, 3) and faces (M, 3) indices.
+    Kept through extrusion and saving so parts are only expanded to STL
+    triangle soup when they are written out.
+    """
+    def __init__(self, vertices, faces):
+        self.vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+        self.faces = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+
+    def translate(self, offset):
+        self.vertices = self.vertices + np.asarray(offset, dtype=np.float64)
+        return self
+
+    def to_stl(self):
+        return build_stl_mesh(self.vertices, self.faces)
+
+def build_stl_mesh(vertices, faces):
     """
+    Builds a numpy-stl Mesh from indexed geometry in one fancy-indexing step.
+    """
+    data = np.zeros(len(faces), dtype=mesh.Mesh.dtype)
+    data['vectors'] = np.asarray(vertices)[np.asarray(faces)]
+    return mesh.Mesh(data)
+
+def extrude_faces_indexed(vertices, faces, height, wall_engine=None, rings=None):
+    """
+    Extrudes 2D faces into a 3D IndexedMesh.
+    When the ring layout from triangulate_polygon is given, walls are built
+    straight from the rings instead of detecting boundary edges.
+    """
+    if rings is not None:
+        # Rings can repeat a coordinate (e.g. a hole touching the exterior at
+        # a vertex) and earcut keeps only one of the copies; weld them so the
+        # caps and the ring walls use the same index
+        canonical = canonical_vertices(vertices)
+        faces = canonical[np.asarray(faces, dtype=np.int64)].reshape(-1, 3)
+        faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])]
+    
     # Create 3D vertices (z=0 and z=height)
     n_verts = len(vertices)
     bottom_verts = np.column_stack([vertices, np.zeros(n_verts)])
@@ -305,13 +650,102 @@ def extrude_faces(vertices, faces, height):
     top_faces = faces + n_verts
     
     # 3. Side faces (walls)
+    if rings is not None:
+        side_faces = side_walls_rings(vertices, faces, rings, canonical)
+    else:
+        engine = WALL_ENGINES[wall_engine or DEFAULT_WALL_ENGINE]
+        side_faces = engine(faces, n_verts)
+                
+    all_faces = np.vstack([bottom_faces, top_faces, side_faces])
+    
+    return IndexedMesh(all_verts, all_faces)
+
+def extrude_faces(vertices, faces, height, wall_engine=None, rings=None):
+    """
+    Extrudes 2D faces into a 3D mesh.
+    """
+    return extrude_faces_indexed(vertices, faces, height, wall_engine=wall_engine, rings=rings).to_stl()
+
+# Side-wall engines for extrude_faces.
+# 'loop' is the original dict + rescan implementation, 'numpy' finds boundary
+# edges with array operations in a single pass. Both emit identical walls.
+# Ring-aware extrusion (side_walls_rings) skips boundary detection entirely.
+DEFAULT_WALL_ENGINE = 'loop'
+
+def wall_triangles(a, b, n_verts):
+    """
+    Two wall triangles per directed boundary edge a -> b.
+    """
+    # Wall a -> b: (a, b, b'), (a, b', a')
+    tri1 = np.column_stack([a, b, b + n_verts])
+    tri2 = np.column_stack([a, b + n_verts, a + n_verts])
+    return np.stack([tri1, tri2], axis=1).reshape(-1, 3)
+
+def canonical_vertices(vertices):
+    """
+    Maps each vertex index to the first index with the same coordinates.
+    """
+    _, first, inverse = np.unique(np.asarray(vertices), axis=0, return_index=True, return_inverse=True)
+    return first[inverse.reshape(-1)].astype(np.int64)
+
+def side_walls_rings(vertices, faces, rings, canonical=None):
+    """
+    Builds wall triangles from consecutive ring vertices.
+    Each ring is walked so the adjacent faces lie on its left in face winding:
+    exteriors follow the triangulation's orientation, holes run against it.
+    canonical (from canonical_vertices) maps ring vertices to the index the
+    faces use for their coordinates.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+    n_verts = len(vertices)
+    
+    # Orientation of the triangulation (earcut keeps it consistent)
+    tri = vertices[faces]
+    face_area = np.sum(
+        (tri[:, 1, 0] - tri[:, 0, 0]) * (tri[:, 2, 1] - tri[:, 0, 1]) -
+        (tri[:, 2, 0] - tri[:, 0, 0]) * (tri[:, 1, 1] - tri[:, 0, 1])
+    )
+    face_sign = 1.0 if face_area >= 0 else -1.0
+    
+    # Earcut drops duplicate/collinear points; skip them so walls match the faces
+    used = np.zeros(n_verts, dtype=bool)
+    used[faces.reshape(-1)] = True
+    
+    starts = []
+    ends = []
+    for start, end, is_hole in rings:
+        idx = np.arange(start, end)
+        if canonical is not None:
+            idx = canonical[idx]
+        idx = idx[used[idx]]
+        # A repeated coordinate would make a zero-length wall
+        idx = idx[idx != np.roll(idx, 1)]
+        if len(idx) < 3: continue
+        
+        x = vertices[idx, 0]
+        y = vertices[idx, 1]
+        ring_area = np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y)
+        
+        want = -face_sign if is_hole else face_sign
+        if ring_area * want < 0:
+            idx = idx[::-1]
+        
+        starts.append(idx)
+        ends.append(np.roll(idx, -1))
+    
+    if not starts:
+        return np.zeros((0, 3), dtype=np.int64)
+    
+    return wall_triangles(np.concatenate(starts), np.concatenate(ends), n_verts)
+
+def side_walls_loop(faces, n_verts):
+    """
+    Builds wall triangles from the boundary edges of a triangulation.
+    Reference implementation: counts edges in a dict, then rescans the faces
+    to recover the winding of every boundary edge.
+    """
     # We need edges.
-    # For now, let's just iterate over all edges in the faces and find boundary edges?
-    # Or simpler: iterate over the original polygon rings.
-    # But we only have vertices/faces here.
-    # Let's assume the vertices are ordered in rings as we constructed them.
-    # Actually, we can just build walls between i and i+1 for the exterior ring.
-    # But we have holes too.
     # Let's extract edges from faces and find those that only appear once (boundary edges).
     
     edges = {}
@@ -328,14 +762,11 @@ def extrude_faces(vertices, faces, height):
         # We need to know the direction to get normals right.
         # The sorted edge lost direction.
         # We can check the original face to see order.
-        # But simpler: just add both triangles and let STL fixers handle it? No, bad.
         
         # Re-find the face to check winding
         for f in faces:
             if v1_idx in f and v2_idx in f:
-                # Check if v1 -> v2 is the order in the face
-                # If so, it's an internal edge if shared, but this is boundary.
-                # Wait, for a single triangle (0, 1, 2), edges are 0-1, 1-2, 2-0.
+                # For a single triangle (0, 1, 2), edges are 0-1, 1-2, 2-0.
                 # If we have 0->1, the wall should be 0->1->1'->0'.
                 
                 # Let's find the index of v1
@@ -356,12 +787,33 @@ def extrude_faces(vertices, faces, height):
                     side_faces.append([v2_idx, v1_idx + n_verts, v2_idx + n_verts])
                 break
                 
-    all_faces = np.vstack([bottom_faces, top_faces, side_faces])
+    return np.array(side_faces, dtype=np.int64).reshape(-1, 3)
+
+def side_walls_numpy(faces, n_verts):
+    """
+    Vectorized equivalent of side_walls_loop.
+    Boundary edges are the sorted edge keys that occur exactly once; since
+    such an edge belongs to a single face, its directed form in that face
+    already carries the winding. Output order matches side_walls_loop.
+    """
+    faces = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
     
-    # Create the mesh object
-    stl_mesh = mesh.Mesh(np.zeros(all_faces.shape[0], dtype=mesh.Mesh.dtype))
-    for i, f in enumerate(all_faces):
-        for j in range(3):
-            stl_mesh.vectors[i][j] = all_verts[f[j]]
-            
-    return stl_mesh
+    # Directed edges in face order: f0(0->1, 1->2, 2->0), f1(...), ...
+    starts = faces.reshape(-1)
+    ends = np.roll(faces, -1, axis=1).reshape(-1)
+    
+    # Undirected key per edge
+    lo = np.minimum(starts, ends)
+    hi = np.maximum(starts, ends)
+    keys = lo * max(n_verts, 1) + hi
+    
+    _, first_idx, counts = np.unique(keys, return_index=True, return_counts=True)
+    
+    # Keep boundary edges in order of first appearance (dict insertion order)
+    boundary = np.sort(first_idx[counts == 1])
+    return wall_triangles(starts[boundary], ends[boundary], n_verts)
+
+WALL_ENGINES = {
+    'loop': side_walls_loop,
+    'numpy': side_walls_numpy,
+}
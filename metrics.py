@@ -0,0 +1,118 @@
+import math
+import threading
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+VERTEX_BUCKETS = (100, 300, 1000, 3000, 10000, 30000, 100000, 300000)
+TRIANGLE_BUCKETS = (1000, 3000, 10000, 30000, 100000, 300000, 1000000, 3000000)
+# Label values come from requests; anything else is 'other' so clients
+# can't create unbounded series
+OUTLINE_TYPES = ('bubble', 'rect', 'none')
+
+def outline_label(outline_type):
+    return outline_type if outline_type in OUTLINE_TYPES else 'other'
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for k, v in labels:
+        v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{k}="{v}"')
+    return '{' + ','.join(parts) + '}'
+
+def format_value(v):
+    if v == math.inf:
+        return '+Inf'
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+class Histogram:
+    """
+    Prometheus-style cumulative histogram with labels.
+    """
+    def __init__(self, name, help_text, buckets, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels.get(name, '')) for name in self.labelnames)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                for bound, count in zip(self.buckets, series['counts']):
+                    labels = format_labels(key + (('le', format_value(bound)),))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{format_labels(key)} {format_value(series['sum'])}")
+                lines.append(f"{self.name}_count{format_labels(key)} {series['count']}")
+        return lines
+
+class CallbackMetric:
+    """
+    Single gauge or counter whose value is read from a callback at scrape
+    time, for numbers another component already tracks.
+    """
+    def __init__(self, name, help_text, read, metric_type='gauge'):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+        self.metric_type = metric_type
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}",
+                f"{self.name} {format_value(self.read())}"]
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+stage_seconds = registry.register(Histogram(
+    'keychain_stage_seconds', 'Wall time of each generation stage.',
+    LATENCY_BUCKETS, ('stage', 'outline_type', 'input_kind')))
+generate_seconds = registry.register(Histogram(
+    'keychain_generate_seconds', 'End-to-end /api/generate latency.',
+    LATENCY_BUCKETS, ('outline_type', 'input_kind', 'status')))
+polygon_vertices = registry.register(Histogram(
+    'keychain_polygon_vertices', 'Polygon vertex count after each geometry stage.',
+    VERTEX_BUCKETS, ('stage', 'outline_type', 'input_kind')))
+output_triangles = registry.register(Histogram(
+    'keychain_output_triangles', 'Triangles in the combined output mesh.',
+    TRIANGLE_BUCKETS, ('outline_type', 'input_kind')))
+
+def record_stage_event(event, labels):
+    """
+    Records a pipeline progress event (see mesh_generator.StageReporter).
+    """
+    stage = event['stage']
+    stage_seconds.observe(event['duration'], stage=stage, **labels)
+    if stage == 'save':
+        output_triangles.observe(event.get('triangles', 0), **labels)
+    elif 'vertices' in event and stage != 'extrusion':
+        polygon_vertices.observe(event['vertices'], stage=stage, **labels)
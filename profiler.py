@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+SAMPLE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL_MS', 1)) / 1000
+
+def frame_stack(frame):
+    # Outermost call first; the function's first line keeps stacks mergeable
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+class StackSampler:
+    """
+    Sampling profiler for a single thread. A background thread snapshots the
+    target thread's stack every interval and counts identical stacks, which
+    are written in the collapsed format ('a;b;c count') read by
+    flamegraph.pl, speedscope and inferno.
+    """
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.thread_id = None
+        self.thread = None
+        self.stopped = threading.Event()
+        self.started = None
+        self.elapsed = None
+
+    def start(self, thread_id=None):
+        self.thread_id = thread_id or threading.get_ident()
+        self.started = time.perf_counter()
+        self.thread = threading.Thread(target=self.run, name='stack-sampler', daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[frame_stack(frame)] += 1
+
+    def stop(self):
+        if self.thread is not None and not self.stopped.is_set():
+            self.stopped.set()
+            self.thread.join()
+            self.elapsed = time.perf_counter() - self.started
+        return self
+
+    def add(self, stacks, prefix=None):
+        """
+        Merges stacks sampled elsewhere (e.g. in a worker process).
+        """
+        for stack, count in stacks.items():
+            self.stacks[f"{prefix};{stack}" if prefix else stack] += count
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return sum(self.stacks.values())
+
+def profile_call(fn, *args, **kwargs):
+    """
+    Runs fn under a StackSampler and returns (result, stacks). Module-level
+    so MeshExecutor can run it inside a worker process.
+    """
+    sampler = StackSampler().start()
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        sampler.stop()
+    return result, dict(sampler.stacks)
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+class ResultCache:
+    """
+    Size-bounded LRU of generation results, keyed by a content hash of the
+    input (image bytes or text + font) and the normalized mesh parameters.
+    """
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def normalize_params(params):
+        """
+        Canonical form of the parameter dict: floats rounded so that 3, 3.0
+        and "3.0" produce the same key, strings stripped.
+        """
+        normalized = {}
+        for k, v in params.items():
+            if isinstance(v, bool) or v is None:
+                normalized[k] = v
+            elif isinstance(v, (int, float)):
+                normalized[k] = round(float(v), 4)
+            else:
+                normalized[k] = str(v).strip()
+        return normalized
+
+    def make_key(self, source_bytes, params):
+        h = hashlib.sha256()
+        h.update(source_bytes)
+        h.update(b'\0')
+        h.update(json.dumps(self.normalize_params(params), sort_keys=True).encode())
+        return h.hexdigest()
+
+    def get(self, key, validate=None):
+        """
+        Returns the cached value or None. If validate is given and returns
+        False for the value (e.g. its files are gone), the entry is dropped.
+        """
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None and validate is not None and not validate(value):
+                del self.entries[key]
+                value = None
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0
+            }
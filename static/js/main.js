@@ -358,9 +358,17 @@ generateBtn.addEventListener('click', async () => {
         const data = await res.json();
         if (data.error) throw new Error(data.error);
 
-        downloadLink.href = data.stl_url;
+        downloadLink.href = data.model_url || data.stl_url;
         downloadBar.classList.remove('hidden');
-        loadSTL(data.stl_url);
+        if (data.mesh_url) {
+            // Compact indexed mesh for viewing; STL/3MF stays the download
+            loadViewerMesh(data.mesh_url).catch((err) => {
+                console.warn("Viewer mesh failed, falling back to STL:", err);
+                if (data.stl_url) loadSTL(data.stl_url);
+            });
+        } else {
+            loadSTL(data.stl_url);
+        }
 
     } catch (err) {
         alert('Server generation failed: ' + err.message);
@@ -429,6 +437,93 @@ function loadSTL(url) {
         });
 }
 
+// Parses the server's .kcm viewer mesh (layout documented in mesh_export.py)
+function parseViewerMesh(buffer) {
+    const view = new DataView(buffer);
+    const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+    if (magic !== 'KCM1' || view.getUint16(4, true) !== 1) throw new Error('Not a KCM1 mesh');
+    const wideIndices = (view.getUint16(6, true) & 1) !== 0;
+    const vertexCount = view.getUint32(8, true);
+    const indexCount = view.getUint32(12, true);
+    const partCount = view.getUint32(16, true);
+    const offset = [0, 1, 2].map(i => view.getFloat32(20 + i * 4, true));
+    const scale = [0, 1, 2].map(i => view.getFloat32(32 + i * 4, true));
+
+    const parts = [];
+    let pos = 44;
+    for (let i = 0; i < partCount; i++, pos += 24) {
+        const name = String.fromCharCode(...new Uint8Array(buffer, pos, 8)).replace(/\0+$/, '');
+        parts.push({
+            name,
+            firstIndex: view.getUint32(pos + 8, true),
+            indexCount: view.getUint32(pos + 12, true),
+            firstVertex: view.getUint32(pos + 16, true),
+            vertexCount: view.getUint32(pos + 20, true)
+        });
+    }
+
+    const quantized = new Uint16Array(buffer, pos, vertexCount * 3);
+    const positions = new Float32Array(vertexCount * 3);
+    for (let i = 0; i < positions.length; i++) {
+        positions[i] = offset[i % 3] + quantized[i] * scale[i % 3];
+    }
+    pos += vertexCount * 6;
+    pos += (4 - pos % 4) % 4;
+    const indices = wideIndices ? new Uint32Array(buffer, pos, indexCount) : new Uint16Array(buffer, pos, indexCount);
+
+    return parts.map(part => {
+        const geometry = new THREE.BufferGeometry();
+        const start = part.firstVertex * 3;
+        geometry.setAttribute('position', new THREE.BufferAttribute(positions.slice(start, start + part.vertexCount * 3), 3));
+        const local = wideIndices ? new Uint32Array(part.indexCount) : new Uint16Array(part.indexCount);
+        for (let i = 0; i < part.indexCount; i++) {
+            local[i] = indices[part.firstIndex + i] - part.firstVertex;
+        }
+        geometry.setIndex(new THREE.BufferAttribute(local, 1));
+        return { name: part.name, geometry };
+    });
+}
+
+async function loadViewerMesh(url) {
+    console.log("Loading viewer mesh from URL:", url);
+    const res = await fetch(url);
+    if (!res.ok) throw new Error(`HTTP ${res.status}`);
+    const parts = parseViewerMesh(await res.arrayBuffer());
+
+    if (!scene) {
+        initViewer();
+        viewerContainer.appendChild(renderer.domElement);
+        placeholder.classList.add('hidden');
+        animate();
+    }
+
+    if (mesh) { scene.remove(mesh); mesh.geometry.dispose(); mesh.material.dispose(); mesh = null; }
+    if (textMesh) { scene.remove(textMesh); textMesh.geometry.dispose(); textMesh.material.dispose(); textMesh = null; }
+    if (baseMesh) { scene.remove(baseMesh); baseMesh.geometry.dispose(); baseMesh.material.dispose(); baseMesh = null; }
+
+    // Center all parts together, as geometry.center() does for a single STL
+    const box = new THREE.Box3();
+    parts.forEach(p => { p.geometry.computeBoundingBox(); box.union(p.geometry.boundingBox); });
+    const center = box.getCenter(new THREE.Vector3());
+
+    const objects = parts.map(p => {
+        p.geometry.translate(-center.x, -center.y, -center.z);
+        // Shared vertices along cap/wall edges: shade per face, no normals needed
+        const material = new THREE.MeshPhysicalMaterial({
+            color: p.name === 'base' ? baseColorInput.value : textColorInput.value,
+            metalness: 0.2, roughness: 0.3, side: THREE.DoubleSide, flatShading: true
+        });
+        const obj = new THREE.Mesh(p.geometry, material);
+        obj.rotation.x = -Math.PI / 2;
+        if (p.name === 'base') baseMesh = obj; else textMesh = obj;
+        scene.add(obj);
+        return obj;
+    });
+
+    fitCamera(objects);
+    console.log("Viewer mesh added to scene. Parts:", parts.map(p => p.name).join(', '));
+}
+
 function fitCamera(objects) {
     const box = new THREE.Box3();
     objects.forEach(obj => box.expandByObject(obj));
@@ -0,0 +1,56 @@
+"""
+Renders text to a grayscale image for the raster (trace the rendering)
+path and for previews.
+"""
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont
+from font_manager import get_font_path
+
+TEXT_FONT_SIZE = 200 # Larger font for better details
+TEXT_PADDING = 50
+
+@lru_cache(maxsize=32)
+def load_font(font_path, font_size):
+    """
+    Process-wide cache of loaded FreeType fonts, keyed by (path, size).
+    """
+    if font_path is None:
+        return ImageFont.load_default()
+    try:
+        return ImageFont.truetype(font_path, font_size)
+    except Exception as e:
+        print(f"Font load error: {e}, using default")
+        return ImageFont.load_default()
+
+def create_text_image(text, output_path, font_name='sans'):
+    """
+    Creates a high-res image of the text for contour tracing.
+    """
+    try:
+        img = render_text_image(text, get_font_path(font_name))
+        img.save(output_path)
+        return True
+    except Exception as e:
+        print(f"Error creating text image: {e}")
+        raise
+
+def render_text_image(text, font_path, font_size=TEXT_FONT_SIZE, padding=TEXT_PADDING):
+    """
+    Black text on a white single-channel canvas sized to the text's ink box.
+    """
+    font = load_font(font_path, font_size)
+    
+    # Size the canvas from the text's ink box instead of a fixed page
+    if '\n' in text:
+        bbox = ImageDraw.Draw(Image.new('L', (1, 1))).multiline_textbbox((0, 0), text, font=font)
+    else:
+        bbox = font.getbbox(text)
+    text_width = bbox[2] - bbox[0]
+    text_height = bbox[3] - bbox[1]
+    
+    # Single-channel canvas with padding around the text
+    img_size = (int(text_width) + 2 * padding, int(text_height) + 2 * padding)
+    img = Image.new('L', img_size, color=255)
+    draw = ImageDraw.Draw(img)
+    draw.text((padding - bbox[0], padding - bbox[1]), text, font=font, fill=0)
+    return img
@@ -0,0 +1,87 @@
+import io
+import os
+import json
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+from mesh_generator import PX_PER_MM, MASK_SUFFIX, binarize
+
+# Longest side of the largest keychain we print; uploads are downsampled so
+# they never trace to more than this many mm (at PX_PER_MM)
+MAX_KEYCHAIN_MM = float(os.environ.get('MAX_KEYCHAIN_MM', 200))
+
+def max_mask_side(max_mm=MAX_KEYCHAIN_MM, px_per_mm=PX_PER_MM):
+    return int(round(max_mm * px_per_mm))
+
+def decode_grayscale(data, max_side):
+    """
+    Decodes image bytes straight to grayscale, no larger than max_side on
+    the longest edge. JPEGs are decoded at reduced DCT scale when the
+    image is much bigger than needed. Returns (gray, source_size).
+    """
+    img = Image.open(io.BytesIO(data))
+    source_size = img.size
+    # JPEG only: picks the smallest 1/2, 1/4, 1/8 scale still >= max_side
+    img.draft('L', (max_side, max_side))
+    # Same orientation as cv2.imread, which honours EXIF rotation
+    img = ImageOps.exif_transpose(img)
+    if img.mode.startswith('I'):
+        # 16-bit grayscale (I;16*, or I as PIL opens 16-bit PNGs):
+        # convert('L') would clip to 255, so scale down like cv2.imread
+        wide = np.asarray(img, dtype=np.int64)
+        gray = (np.clip(wide, 0, 65535) >> 8).astype(np.uint8)
+    else:
+        gray = np.asarray(img.convert('L'))
+    h, w = gray.shape
+    scale = max_side / max(w, h)
+    if scale < 1:
+        size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    return gray, source_size
+
+def normalize_upload(data, folder, file_id, filename=None):
+    """
+    Decodes an uploaded image once, thresholds it to the foreground mask the
+    mesh pipeline traces and stores it as a 1-bit PNG plus a JSON metadata
+    sidecar. Returns the metadata. Raises ValueError for undecodable data.
+    """
+    try:
+        gray, (source_w, source_h) = decode_grayscale(data, max_mask_side())
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Could not decode image: {e}")
+    mask = binarize(gray)
+    if not mask.any():
+        # Would upload fine and then fail every generate
+        raise ValueError("No shape found in image: it needs dark content on a light background")
+    h, w = mask.shape
+    mask_path = os.path.join(folder, f"{file_id}{MASK_SUFFIX}")
+    cv2.imwrite(mask_path, mask, [cv2.IMWRITE_PNG_BILEVEL, 1])
+    meta = {
+        'file_id': file_id,
+        'filename': filename,
+        'source_width': source_w,
+        'source_height': source_h,
+        'source_bytes': len(data),
+        'width': w,
+        'height': h,
+        'scale': w / source_w,
+        'px_per_mm': PX_PER_MM,
+        'width_mm': round(w / PX_PER_MM, 2),
+        'height_mm': round(h / PX_PER_MM, 2),
+        'mask_bytes': os.path.getsize(mask_path)
+    }
+    with open(os.path.join(folder, f"{file_id}.json"), 'w') as f:
+        json.dump(meta, f)
+    return meta
+
+def find_upload(store, file_id):
+    """
+    Path to generate from for an upload id: its mask, or the raw file for
+    uploads stored before normalization. None if there is neither.
+    """
+    # Index lookups; only names the store knows are checked on disk
+    for suffix in [MASK_SUFFIX, '.png', '.jpg', '.jpeg']:
+        path = store.resolve(f"{file_id}{suffix}")
+        if path:
+            return path
+    return None
@@ -0,0 +1,51 @@
+import io
+import zipfile
+
+class ZipChunkBuffer(io.RawIOBase):
+    """
+    Write-only, unseekable sink for ZipFile. Bytes are collected until the
+    streaming generator takes them with drain().
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def stream_zip(entries, compression=zipfile.ZIP_DEFLATED):
+    """
+    Yields a ZIP archive chunk by chunk. entries is an iterable of
+    (arcname, path) to copy from disk or (arcname, bytes); each entry is
+    written and flushed downstream as soon as the iterable produces it.
+    """
+    sink = ZipChunkBuffer()
+    # ZipFile falls back to data descriptors on an unseekable stream
+    with zipfile.ZipFile(sink, 'w', compression=compression) as zf:
+        for arcname, content in entries:
+            if isinstance(content, (bytes, bytearray)):
+                zf.writestr(arcname, content)
+            else:
+                with open(content, 'rb') as src, zf.open(arcname, 'w') as dst:
+                    while True:
+                        block = src.read(1024 * 1024)
+                        if not block:
+                            break
+                        dst.write(block)
+                        data = sink.drain()
+                        if data:
+                            yield data
+            data = sink.drain()
+            if data:
+                yield data
+    data = sink.drain()
+    if data:
+        yield data